@@ -0,0 +1,169 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import InvalidPage
+from django.db import close_old_connections
+from django.utils.translation import gettext
+from rest_framework.exceptions import NotFound
+
+from .profiling import install_query_profiler, serialize
+from .utils import get_followed_author_ids
+from .views import (FollowViewSet, IngredientListView, RecipeViewSet,
+                    TagViewSet)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.ASYNC_DB_THREADS,
+            thread_name_prefix="async-db",
+        )
+    return _executor
+
+
+def _call_with_connections(func, *args, **kwargs):
+    close_old_connections()
+    install_query_profiler()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run(func, *args, **kwargs):
+    # Запросы к базе выполняются в ограниченном пуле потоков,
+    # чтобы число одновременных соединений не росло вместе с нагрузкой.
+    return await sync_to_async(
+        _call_with_connections, thread_sensitive=False,
+        executor=get_executor(),
+    )(func, *args, **kwargs)
+
+
+class AsyncReadView:
+    viewset = None
+    action = None
+    actions = None
+
+    def __init__(self):
+        self.sync_view = self.viewset.as_view(self.actions)
+
+    def as_view(self):
+        async def view(request, *args, **kwargs):
+            return await self.dispatch(request, *args, **kwargs)
+
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method != "GET":
+            return await sync_to_async(self.sync_view)(
+                request, *args, **kwargs
+            )
+        view = self.viewset(
+            action_map={"get": self.action}, format_kwarg=None
+        )
+        view.args = args
+        view.kwargs = kwargs
+        view.headers = view.default_response_headers
+        drf_request = view.initialize_request(request, *args, **kwargs)
+        view.request = drf_request
+        try:
+            await run(view.initial, drf_request, *args, **kwargs)
+            response = await self.get(view, drf_request, *args, **kwargs)
+        except Exception as exc:
+            response = view.handle_exception(exc)
+        return view.finalize_response(drf_request, response, *args, **kwargs)
+
+    async def get(self, view, request, *args, **kwargs):
+        handler = getattr(view, self.action)
+        return await run(handler, request, *args, **kwargs)
+
+
+class AsyncListView(AsyncReadView):
+    action = "list"
+
+    async def get(self, view, request, *args, **kwargs):
+        paginator = view.paginator
+        page_number = request.query_params.get(
+            paginator.page_query_param, "1"
+        )
+        if (
+            paginator.cursor_pagination_class.cursor_query_param
+            in request.query_params
+            or request.query_params.get("pagination") == "cursor"
+            or not page_number.isdigit()
+        ):
+            return await super().get(view, request, *args, **kwargs)
+        if int(page_number) < 1:
+            # Отрицательное смещение сломает срез: отвечаем так же,
+            # как синхронный пагинатор.
+            raise NotFound(paginator.invalid_page_message.format(
+                page_number=page_number,
+                message=gettext("That page number is less than 1"),
+            ))
+        queryset = await run(view.get_list_queryset)
+        page_size = paginator.get_page_size(request)
+        django_paginator = paginator.django_paginator_class(
+            queryset, page_size
+        )
+        offset = (int(page_number) - 1) * page_size
+        # Страница, общее число и подписки пользователя не зависят
+        # друг от друга и загружаются одновременно.
+        rows, _, followed_author_ids = await asyncio.gather(
+            run(list, queryset[offset:offset + page_size]),
+            run(getattr, django_paginator, "count"),
+            run(get_followed_author_ids, request),
+        )
+        request.followed_author_ids = followed_author_ids
+        try:
+            number = django_paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(paginator.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            ))
+        paginator.cursor_pagination = None
+        paginator.request = request
+        paginator.page = django_paginator._get_page(
+            rows, number, django_paginator
+        )
+        serializer = view.get_serializer(paginator.page, many=True)
+        data = await run(serialize, serializer)
+        return paginator.get_paginated_response(data)
+
+
+class RecipeListView(AsyncListView):
+    viewset = RecipeViewSet
+    actions = {"get": "list", "post": "create"}
+
+
+class RecipeDetailView(AsyncReadView):
+    viewset = RecipeViewSet
+    action = "retrieve"
+    actions = {
+        "get": "retrieve",
+        "put": "update",
+        "patch": "partial_update",
+        "delete": "destroy",
+    }
+
+
+class SubscriptionListView(AsyncListView):
+    viewset = FollowViewSet
+    actions = {"get": "list"}
+
+
+class TagListView(AsyncReadView):
+    viewset = TagViewSet
+    action = "list"
+    actions = {"get": "list"}
+
+
+class IngredientSearchView(AsyncReadView):
+    viewset = IngredientListView
+    action = "list"
+    actions = {"get": "list"}
@@ -0,0 +1,41 @@
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from foodgram_backend.db.replicas import use_primary
+from recipes.cache import shared_cache
+
+TOKEN_KEY = "auth-token:{}"
+
+
+def token_cache_key(key):
+    # Сам токен в ключ кеша не попадает.
+    return TOKEN_KEY.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+def invalidate_tokens(keys):
+    cache_keys = [token_cache_key(key) for key in keys]
+    if cache_keys:
+        transaction.on_commit(lambda: shared_cache().delete_many(cache_keys))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        user = shared_cache().get(cache_key)
+        if user is None:
+            # Токен, выданный только что, мог еще не дойти до реплики.
+            with use_primary():
+                user, token = super().authenticate_credentials(key)
+            shared_cache().set(
+                cache_key, user, settings.AUTH_CACHE_TIMEOUT
+            )
+            return user, token
+        if not user.is_active:
+            raise AuthenticationFailed(_("User inactive or deleted."))
+        return user, Token(key=key, user=user)
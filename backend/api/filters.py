@@ -1,34 +1,55 @@
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
+from rest_framework.filters import OrderingFilter
 
-from recipes.models import Recipe, Tag
+from recipes.models import Recipe, Tag, TagRecipe
+from recipes.search import search_recipes
 
 
 class RecipeFilter(filters.FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
         field_name="tags__slug",
         to_field_name="slug",
-        queryset=Tag.objects.all()
+        queryset=Tag.objects.all(),
+        method="tags_filter",
     )
     is_favorited = filters.BooleanFilter(method="is_favorited_filter")
     is_in_shopping_cart = filters.BooleanFilter(
         method="is_in_shopping_cart_filter")
+    search = filters.CharFilter(method="search_filter")
 
     class Meta:
         model = Recipe
         fields = ("author", "tags")
 
+    def tags_filter(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(Exists(TagRecipe.objects.filter(
+            recipe=OuterRef("pk"), tag__in=value
+        )))
+
     def is_favorited_filter(self, queryset, name, value):
-        user = self.request.user
-        if user.is_authenticated:
-            if not value:
-                return queryset.exclude(favorite__user=user)
-            return queryset.filter(favorite__user=user)
+        if self.request.user.is_authenticated:
+            return queryset.filter(is_favorited=value)
         return queryset
 
     def is_in_shopping_cart_filter(self, queryset, name, value):
-        user = self.request.user
-        if user.is_authenticated:
-            if not value:
-                return queryset.exclude(cart__user=user)
-            return queryset.filter(cart__user=user)
+        if self.request.user.is_authenticated:
+            return queryset.filter(is_in_shopping_cart=value)
         return queryset
+
+    def search_filter(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    def filter_queryset(self, request, queryset, view):
+        # Результаты поиска уже упорядочены по релевантности: порядок по
+        # умолчанию применяется, только если его явно запросили.
+        if (
+            request.query_params.get("search")
+            and self.ordering_param not in request.query_params
+        ):
+            return queryset
+        return super().filter_queryset(request, queryset, view)
@@ -0,0 +1,32 @@
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from recipes.cache import get_or_set, get_version
+
+
+class CachedListMixin:
+    cache_namespace = None
+
+    def get_list_data(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs).data
+
+    def list(self, request, *args, **kwargs):
+        version = get_version(self.cache_namespace)
+        etag = f'"{self.cache_namespace}-{version["version"]}"'
+        last_modified = int(version["modified"])
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if not_modified is not None:
+            not_modified["ETag"] = etag
+            return not_modified
+        data = get_or_set(
+            self.cache_namespace,
+            request.query_params.urlencode(),
+            lambda: self.get_list_data(request, *args, **kwargs),
+        )
+        response = Response(data)
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        return response
@@ -1,10 +1,99 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+
+from django.apps import apps
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connection, connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+from recipes.cache import get_version, shared_cache, table_namespace
 
 PAGE_SIZE = 6
 MAX_PAGE_SIZE = 100
 
 
+class CachedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, "query"):
+            return super().count
+        if queryset.query.is_empty():
+            return 0
+        if not queryset.query.where:
+            estimate = self.estimate_count(queryset)
+            if estimate >= settings.PAGINATION_ESTIMATE_THRESHOLD:
+                return estimate
+        sql = str(queryset.order_by().values("pk").query)
+        # Версии всех таблиц запроса, включая подзапросы фильтров:
+        # запись в любую из них сбрасывает сохраненное количество.
+        versions = [
+            str(get_version(table_namespace(table))["version"])
+            for table in self.query_tables(sql)
+        ]
+        key = "pagination-count:" + hashlib.md5(
+            ":".join([sql, *versions]).encode()
+        ).hexdigest()
+        count = shared_cache().get(key)
+        if count is None:
+            count = super().count
+            shared_cache().set(
+                key, count, settings.PAGINATION_COUNT_CACHE_TIMEOUT
+            )
+        return count
+
+    def query_tables(self, sql):
+        return sorted(
+            model._meta.db_table
+            for model in apps.get_models(include_auto_created=True)
+            if connection.ops.quote_name(model._meta.db_table) in sql
+        )
+
+    def estimate_count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return int(row[0]) if row else 0
+
+
 class CustomPagination(PageNumberPagination):
+    django_paginator_class = CachedCountPaginator
     page_size = PAGE_SIZE
     page_size_query_param = "limit"
     max_page_size = MAX_PAGE_SIZE
+
+
+class IdCursorPagination(CursorPagination):
+    page_size = PAGE_SIZE
+    page_size_query_param = "limit"
+    max_page_size = MAX_PAGE_SIZE
+    ordering = "-id"
+
+
+class CursorOptInPagination(CustomPagination):
+    cursor_pagination_class = IdCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_pagination = None
+        if (
+            request.query_params.get("pagination") == "cursor"
+            or self.cursor_pagination_class.cursor_query_param
+            in request.query_params
+        ):
+            self.cursor_pagination = self.cursor_pagination_class()
+            return self.cursor_pagination.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,300 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import request_started
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Профиль текущего запроса: async-представления выполняют запросы к базе
+# и сериализацию в пуле потоков, куда контекст копирует asgiref.
+current_profile = ContextVar("current_profile", default=None)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series.setdefault(
+                labels, [[0] * (len(self.buckets) + 1), 0, 0]
+            )
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            label_text = format_labels(labels)
+            cumulative = 0
+            for bound, bucket_count in zip(
+                self.buckets + ("+Inf",), counts
+            ):
+                cumulative += bucket_count
+                lines.append(
+                    f'{self.name}_bucket{{{label_text},le="{bound}"}} '
+                    f"{cumulative}"
+                )
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+
+    def inc(self, labels):
+        self.series[labels] = self.series.get(labels, 0) + 1
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} counter",
+        ]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{{{format_labels(labels)}}} {value}")
+        return lines
+
+
+def format_labels(labels):
+    method, endpoint = labels
+    endpoint = endpoint.replace("\\", "\\\\").replace('"', '\\"')
+    return f'method="{method}",endpoint="{endpoint}"'
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.duration = Histogram(
+            "foodgram_request_duration_seconds",
+            "Полное время обработки запроса.",
+            SECONDS_BUCKETS,
+        )
+        self.queries = Histogram(
+            "foodgram_request_queries",
+            "Число SQL-запросов (выборочно).",
+            QUERIES_BUCKETS,
+        )
+        self.db = Histogram(
+            "foodgram_request_db_seconds",
+            "Время SQL-запросов (выборочно).",
+            SECONDS_BUCKETS,
+        )
+        self.serialize_time = Histogram(
+            "foodgram_request_serialize_seconds",
+            "Время serializer.data в представлениях (выборочно).",
+            SECONDS_BUCKETS,
+        )
+        self.render_time = Histogram(
+            "foodgram_request_render_seconds",
+            "Время рендеринга ответа в JSON (выборочно).",
+            SECONDS_BUCKETS,
+        )
+        self.over_budget = Counter(
+            "foodgram_requests_over_budget_total",
+            "Запросы, превысившие бюджет по времени или числу запросов.",
+        )
+
+    def record(self, labels, profile):
+        with self.lock:
+            self.duration.observe(labels, profile.total)
+            if profile.sampled:
+                self.queries.observe(labels, profile.queries)
+                self.db.observe(labels, profile.db)
+                if profile.serialized:
+                    self.serialize_time.observe(labels, profile.serialize)
+                if profile.render_start is not None:
+                    self.render_time.observe(labels, profile.render)
+            if profile.over_budget:
+                self.over_budget.inc(labels)
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in (self.duration, self.queries, self.db,
+                           self.serialize_time, self.render_time,
+                           self.over_budget):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class RequestProfile:
+    def __init__(self, sampled):
+        self.sampled = sampled
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db = 0
+        self.serialize = 0
+        self.serialized = False
+        self.render = 0
+        self.render_start = None
+        self.total = 0
+        self.over_budget = False
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            # Запросы одной страницы могут идти параллельно в разных потоках.
+            with self.lock:
+                self.db += elapsed
+                self.queries += 1
+
+    def start_render(self):
+        self.render_start = time.perf_counter()
+
+    def finish_render(self, response):
+        self.render = time.perf_counter() - self.render_start
+
+    def server_timing(self):
+        parts = []
+        if self.sampled:
+            parts.append(
+                f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"'
+            )
+            if self.serialized:
+                parts.append(f"serialize;dur={self.serialize * 1000:.1f}")
+            if self.render_start is not None:
+                parts.append(f"render;dur={self.render * 1000:.1f}")
+        parts.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def execute_profiled(execute, sql, params, many, context):
+    profile = current_profile.get()
+    if profile is None or not profile.sampled:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def install_query_profiler(**kwargs):
+    # execute_wrapper действует только на соединения текущего потока.
+    # Обертка ставится на них один раз и берет профиль из контекста,
+    # поэтому одновременные запросы в общем потоке не смешиваются.
+    if not settings.PROFILING_ENABLED:
+        return
+    for connection in connections.all():
+        if execute_profiled not in connection.execute_wrappers:
+            connection.execute_wrappers.append(execute_profiled)
+
+
+def serialize(serializer):
+    profile = current_profile.get()
+    if profile is None or not profile.sampled:
+        return serializer.data
+    start = time.perf_counter()
+    try:
+        return serializer.data
+    finally:
+        elapsed = time.perf_counter() - start
+        with profile.lock:
+            profile.serialize += elapsed
+            profile.serialized = True
+
+
+def endpoint_label(request):
+    match = request.resolver_match
+    if match is None:
+        return "unmatched"
+    if match.url_name:
+        return match.view_name
+    return match.route
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        # Под ASGI сигнал приходит в поток, где выполняются синхронные
+        # представления.
+        request_started.connect(
+            install_query_profiler, dispatch_uid="install_query_profiler"
+        )
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        profile = self.start_profile(request)
+        token = current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish_profile(request, profile, response)
+
+    async def __acall__(self, request):
+        profile = self.start_profile(request)
+        token = current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish_profile(request, profile, response)
+
+    def start_profile(self, request):
+        profile = RequestProfile(
+            random.random() < settings.PROFILING_SAMPLE_RATE
+        )
+        request.profile = profile
+        return profile
+
+    def finish_profile(self, request, profile, response):
+        profile.total = time.perf_counter() - profile.start
+        profile.over_budget = (
+            profile.total * 1000 > settings.PROFILING_LATENCY_BUDGET_MS
+            or profile.queries > settings.PROFILING_QUERY_BUDGET
+        )
+        labels = (request.method, endpoint_label(request))
+        metrics.record(labels, profile)
+        if profile.over_budget:
+            logger.warning(
+                "%s %s: %.0f мс, %s SQL-запросов (%.0f мс)",
+                request.method, request.path, profile.total * 1000,
+                profile.queries if profile.sampled else "?",
+                profile.db * 1000,
+            )
+        response["Server-Timing"] = profile.server_timing()
+        return response
+
+    def process_template_response(self, request, response):
+        profile = getattr(request, "profile", None)
+        if profile is not None and profile.sampled:
+            profile.start_render()
+            response.add_post_render_callback(profile.finish_render)
+        return response
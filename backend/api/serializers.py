@@ -1,15 +1,28 @@
-import base64
+import binascii
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from rest_framework.serializers import (ImageField, IntegerField,
-                                        ModelSerializer,
-                                        PrimaryKeyRelatedField, ReadOnlyField,
-                                        SerializerMethodField, ValidationError)
-
+from rest_framework.serializers import (Field, ImageField, IntegerField,
+                                        ListField, ModelSerializer,
+                                        ReadOnlyField, Serializer,
+                                        SerializerMethodField,
+                                        ValidationError)
+
+from recipes.cache import bump_version
+from recipes.images import schedule_image_processing
 from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
                             ShoppingCart, Tag)
+from recipes.search import update_search_vectors
+from recipes.services import change_recipe_cart_totals, lock_cart_users
 from users.models import Follow
+from .utils import (check_image_header, decode_base64_image,
+                    get_followed_author_ids, get_recipes_limit)
+
+BASE64_HEADER_LENGTH = 64
+IMAGE_HEADER_SIZE = 64 * 1024
+BULK_IDS_LIMIT = 500
 
 
 class CustomUserSerializer(UserSerializer):
@@ -27,11 +40,7 @@ class CustomUserSerializer(UserSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get("request")
-        if not request.user.is_authenticated or not Follow.objects.filter(
-            user=request.user, author=obj
-        ).exists():
-            return False
-        return True
+        return obj.id in get_followed_author_ids(request)
 
 
 class UserCreateSerializer(UserCreateSerializer):
@@ -49,12 +58,35 @@ class UserCreateSerializer(UserCreateSerializer):
 class Base64ImageField(ImageField):
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith("data:image"):
-            format, imgstr = data.split(";base64,")
-            ext = format.split("/")[-1]
-            data = ContentFile(base64.b64decode(imgstr), name="temp." + ext)
+            start = data.find(";base64,", 0, BASE64_HEADER_LENGTH)
+            if start == -1:
+                raise ValidationError("Некорректное изображение.")
+            try:
+                data = decode_base64_image(data, start + len(";base64,"))
+            except binascii.Error:
+                raise ValidationError("Некорректное изображение.")
+            except ValueError as error:
+                raise ValidationError(str(error))
         return super().to_internal_value(data)
 
 
+class ImageVariantField(Field):
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        kwargs["source"] = "*"
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        image = getattr(value, self.variant) or value.image
+        if not image:
+            return None
+        request = self.context.get("request")
+        if request is None:
+            return image.url
+        return request.build_absolute_uri(image.url)
+
+
 class TagSerializer(ModelSerializer):
     class Meta:
         model = Tag
@@ -92,6 +124,8 @@ class IngredientRecipeSerializer(ModelSerializer):
 class RecipeSerializer(ModelSerializer):
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
+    image_thumb = ImageVariantField("image_thumb")
+    image_medium = ImageVariantField("image_medium")
     tags = TagSerializer(many=True)
     author = CustomUserSerializer(read_only=True)
     ingredients = IngredientRecipeSerializer(
@@ -109,11 +143,15 @@ class RecipeSerializer(ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "image_thumb",
+            "image_medium",
             "text",
             "cooking_time",
         )
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, "is_favorited"):
+            return obj.is_favorited
         request = self.context["request"]
         return (
             request.user.is_authenticated and Favorite.objects.filter(
@@ -122,6 +160,8 @@ class RecipeSerializer(ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, "is_in_shopping_cart"):
+            return obj.is_in_shopping_cart
         request = self.context["request"]
         return (
             request.user.is_authenticated and ShoppingCart.objects.filter(
@@ -130,11 +170,33 @@ class RecipeSerializer(ModelSerializer):
         )
 
 
+class RecipeImageSerializer(ModelSerializer):
+    class Meta:
+        model = Recipe
+        fields = ("image",)
+
+    def validate_image(self, value):
+        if value.size > settings.MAX_IMAGE_UPLOAD_SIZE:
+            raise ValidationError("Изображение слишком большое.")
+        value.seek(0)
+        try:
+            check_image_header(value.read(IMAGE_HEADER_SIZE))
+        except ValueError as error:
+            raise ValidationError(str(error))
+        value.seek(0)
+        return value
+
+    def update(self, instance, validated_data):
+        recipe = super().update(instance, validated_data)
+        schedule_image_processing(recipe.id)
+        return recipe
+
+    def to_representation(self, instance):
+        return RecipeSerializer(instance, context=self.context).data
+
+
 class IngredientRecipeCreateSerializer(ModelSerializer):
-    id = PrimaryKeyRelatedField(
-        source="ingredient",
-        queryset=Ingredient.objects.all()
-    )
+    id = IntegerField()
     amount = IntegerField()
 
     class Meta:
@@ -145,10 +207,7 @@ class IngredientRecipeCreateSerializer(ModelSerializer):
 class RecipeCreateUpdateSerializer(ModelSerializer):
     ingredients = IngredientRecipeCreateSerializer(many=True)
     image = Base64ImageField(max_length=None)
-    tags = PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True
-    )
+    tags = ListField(child=IntegerField())
 
     class Meta:
         model = Recipe
@@ -162,37 +221,83 @@ class RecipeCreateUpdateSerializer(ModelSerializer):
 
         )
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop("ingredients")
         recipe = super().create(validated_data)
         ingredient_recipe_instances = [
             IngredientRecipe(
                 recipe=recipe,
-                ingredient=ingredient_data["ingredient"],
+                ingredient_id=ingredient_data["id"],
                 amount=ingredient_data["amount"],
             )
             for ingredient_data in ingredients_data
         ]
         IngredientRecipe.objects.bulk_create(ingredient_recipe_instances)
+        update_search_vectors([recipe.id])
+        bump_version("recipe_ingredients")
+        schedule_image_processing(recipe.id)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients_data = validated_data.pop("ingredients")
+        ingredients_data = validated_data.pop("ingredients", None)
+        if ingredients_data is not None:
+            lock_cart_users([instance.id])
         recipe = super().update(instance, validated_data)
-        IngredientRecipe.objects.filter(recipe=recipe).delete()
-        ingredient_recipe_instances = [
-            IngredientRecipe(
-                recipe=recipe,
-                ingredient=ingredient_data["ingredient"],
-                amount=ingredient_data["amount"],
+        if ingredients_data is not None:
+            old_amounts, new_amounts = self.update_ingredients(
+                recipe, ingredients_data
             )
+            if old_amounts != new_amounts:
+                change_recipe_cart_totals(recipe.id, old_amounts, new_amounts)
+                bump_version("recipe_ingredients")
+        update_search_vectors([recipe.id])
+        if "image" in validated_data:
+            schedule_image_processing(recipe.id)
+        return recipe
+
+    def update_ingredients(self, recipe, ingredients_data):
+        amounts = {
+            ingredient_data["id"]: ingredient_data["amount"]
             for ingredient_data in ingredients_data
+        }
+        existing = {
+            ingredient_recipe.ingredient_id: ingredient_recipe
+            for ingredient_recipe in recipe.ingredients_recipes.all()
+        }
+        old_amounts = {
+            ingredient_id: ingredient_recipe.amount
+            for ingredient_id, ingredient_recipe in existing.items()
+        }
+        to_delete = [
+            ingredient_recipe.id
+            for ingredient_id, ingredient_recipe in existing.items()
+            if ingredient_id not in amounts
         ]
-
-        IngredientRecipe.objects.bulk_create(ingredient_recipe_instances)
-        return recipe
+        to_update = []
+        to_create = []
+        for ingredient_id, amount in amounts.items():
+            ingredient_recipe = existing.get(ingredient_id)
+            if ingredient_recipe is None:
+                to_create.append(IngredientRecipe(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=amount
+                ))
+            elif ingredient_recipe.amount != amount:
+                ingredient_recipe.amount = amount
+                to_update.append(ingredient_recipe)
+        if to_delete:
+            IngredientRecipe.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            IngredientRecipe.objects.bulk_update(to_update, ["amount"])
+        if to_create:
+            IngredientRecipe.objects.bulk_create(to_create)
+        return old_amounts, amounts
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance], "ingredients_recipes__ingredient", "tags"
+        )
         serializer = RecipeSerializer(
             instance, context={"request": self.context["request"]}
         )
@@ -203,27 +308,40 @@ class RecipeCreateUpdateSerializer(ModelSerializer):
 
         ingredients = data.get("ingredients")
         if not ingredients:
-            error_messages.append("Добавьте ингредиенты.")
+            if not self.partial or "ingredients" in data:
+                error_messages.append("Добавьте ингредиенты.")
         else:
             all_ingredient_ids = []
 
             for ingredient_data in ingredients:
-                ingredient_id = ingredient_data.get("ingredient").id
+                ingredient_id = ingredient_data.get("id")
                 all_ingredient_ids.append(ingredient_id)
                 amount = ingredient_data.get("amount")
                 if amount <= 0:
                     error_messages.append("Вес должен быть положительным")
             if len(all_ingredient_ids) != len(set(all_ingredient_ids)):
                 error_messages.append("Одинаковые ингредиенты")
+            elif Ingredient.objects.filter(
+                id__in=all_ingredient_ids
+            ).count() != len(all_ingredient_ids):
+                error_messages.append("Ингредиент не найден")
 
         tags = data.get("tags")
         if not tags:
-            error_messages.append("Укажите хотя бы 1 тег")
+            if not self.partial or "tags" in data:
+                error_messages.append("Укажите хотя бы 1 тег")
         elif len(tags) != len(set(tags)):
             error_messages.append("Дублирование тегов")
+        else:
+            data["tags"] = list(Tag.objects.filter(id__in=tags))
+            if len(data["tags"]) != len(tags):
+                error_messages.append("Тег не найден")
 
         name = data.get("name")
-        if Recipe.objects.filter(name=name).exists():
+        recipes = Recipe.objects.filter(name=name)
+        if self.instance is not None:
+            recipes = recipes.exclude(id=self.instance.id)
+        if name is not None and recipes.exists():
             error_messages.append("Имя рецепта занято")
 
         if error_messages:
@@ -233,9 +351,11 @@ class RecipeCreateUpdateSerializer(ModelSerializer):
 
 
 class FollowRecipeSerializer(ModelSerializer):
+    image_thumb = ImageVariantField("image_thumb")
+
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_thumb", "cooking_time")
 
 
 class FavoriteSerializer(ModelSerializer):
@@ -263,7 +383,8 @@ class ShoppingCartSerializer(ModelSerializer):
 class FollowSerializer(ModelSerializer):
     author = ReadOnlyField(source="author.id")
     is_subscribed = SerializerMethodField()
-    recipes = FollowRecipeSerializer(source="author.recipes", many=True)
+    recipes = SerializerMethodField()
+    recipes_count = SerializerMethodField()
 
     class Meta:
         model = Follow
@@ -271,6 +392,7 @@ class FollowSerializer(ModelSerializer):
             "author",
             "is_subscribed",
             "recipes",
+            "recipes_count",
         )
 
     def create(self, validated_data):
@@ -308,8 +430,42 @@ class FollowSerializer(ModelSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get("request")
-        if not request.user.is_authenticated or not Follow.objects.filter(
-            user=request.user, author=obj.author
-        ).exists():
-            return False
-        return True
+        return obj.author_id in get_followed_author_ids(request)
+
+    def get_recipes(self, obj):
+        if hasattr(obj.author, "limited_recipes"):
+            recipes = obj.author.limited_recipes
+        else:
+            recipes = obj.author.recipes.all()
+            limit = get_recipes_limit(self.context.get("request"))
+            if limit is not None:
+                recipes = recipes[:limit]
+        return FollowRecipeSerializer(
+            recipes, many=True, context=self.context
+        ).data
+
+    def get_recipes_count(self, obj):
+        if hasattr(obj, "recipes_count"):
+            return obj.recipes_count
+        return obj.author.recipes.count()
+
+
+class BulkIdsSerializer(Serializer):
+    ids = ListField(
+        child=IntegerField(), allow_empty=False, max_length=BULK_IDS_LIMIT
+    )
+
+
+class CartBulkSerializer(BulkIdsSerializer):
+    ids = ListField(
+        child=IntegerField(), allow_empty=False, max_length=BULK_IDS_LIMIT,
+        required=False,
+    )
+    author = IntegerField(required=False)
+
+    def validate(self, data):
+        if "ids" in data and "author" in data:
+            raise ValidationError(
+                {"errors": "Укажите либо список рецептов, либо автора"}
+            )
+        return data
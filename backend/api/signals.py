@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from users.models import Follow, auth_fields_updated
+from .authentication import invalidate_tokens
+from .utils import forget_followed_authors
+
+User = get_user_model()
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(instance, **kwargs):
+    invalidate_tokens([instance.key])
+
+
+@receiver((post_save, post_delete), sender=User)
+def invalidate_user_tokens(instance, **kwargs):
+    # Смена пароля, деактивация и правка профиля сбрасывают снимок.
+    invalidate_tokens(
+        Token.objects.filter(user_id=instance.id).values_list(
+            "key", flat=True
+        )
+    )
+
+
+@receiver(auth_fields_updated, sender=User)
+def invalidate_updated_users_tokens(user_ids, **kwargs):
+    invalidate_tokens(
+        Token.objects.filter(user_id__in=user_ids).values_list(
+            "key", flat=True
+        )
+    )
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def invalidate_followed_authors(instance, **kwargs):
+    forget_followed_authors(instance.user_id)
@@ -0,0 +1,576 @@
+import asyncio
+import time
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from django.contrib.admin import site
+from django.db import connection
+from django.http import HttpResponse
+from django.test import (AsyncClient, AsyncRequestFactory, TestCase,
+                         override_settings)
+from django.urls import path
+from django.utils.http import http_date
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.admin import RecipeAdmin
+from recipes.cache import local_cache, shared_cache
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, ShoppingCartTotal, Tag, TagRecipe)
+from recipes.search import update_search_vectors
+from recipes.services import (add_follows, add_recipes,
+                              calculate_cart_totals, rebuild_cart_totals)
+from users.models import Follow, User
+from .async_views import RecipeListView
+
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+PAGE_SIZES = (2, 10)
+# На PostgreSQL пагинатор перед подсчетом строк читает оценку из pg_class.
+ESTIMATE_QUERIES = int(connection.vendor == "postgresql")
+SLOW_VIEW_SECONDS = 0.2
+
+
+async def slow_view(request):
+    await asyncio.sleep(SLOW_VIEW_SECONDS)
+    return HttpResponse()
+
+
+urlpatterns = [
+    path("api/recipes/", RecipeListView().as_view()),
+    path("api/slow/", slow_view),
+]
+
+
+@override_settings(CACHES=CACHES)
+class RecipeQueryCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password",
+            first_name="Имя", last_name="Фамилия",
+        )
+        author = User.objects.create_user(
+            username="author", email="author@example.com",
+            password="password", first_name="Имя", last_name="Фамилия",
+        )
+        tags = [
+            Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (
+                ("Завтрак", "#E26C2D", "breakfast"),
+                ("Обед", "#49B64E", "lunch"),
+            )
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f"ингредиент {number}", measurement_unit="г"
+            )
+            for number in range(3)
+        ]
+        for number in range(12):
+            recipe = Recipe.objects.create(
+                author=author, name=f"Рецепт {number}", text="Текст",
+                image="recipes/test.png", cooking_time=10,
+            )
+            TagRecipe.objects.bulk_create(
+                TagRecipe(recipe=recipe, tag=tag) for tag in tags
+            )
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=100
+                )
+                for ingredient in ingredients
+            )
+            Favorite.objects.create(user=cls.user, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        cls.recipe = recipe
+
+    def setUp(self):
+        shared_cache().clear()
+        local_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_list_queries(self, params, queries):
+        # Число запросов не должно зависеть от размера страницы.
+        for page_size in PAGE_SIZES:
+            shared_cache().clear()
+            with self.subTest(params=params, limit=page_size):
+                with self.assertNumQueries(queries):
+                    response = self.client.get(
+                        "/api/recipes/", {**params, "limit": page_size}
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data["results"]), page_size)
+
+    def test_list(self):
+        self.assert_list_queries({}, 6 + ESTIMATE_QUERIES)
+
+    def test_favorites_filter(self):
+        self.assert_list_queries({"is_favorited": 1}, 6)
+
+    def test_shopping_cart_filter(self):
+        self.assert_list_queries({"is_in_shopping_cart": 1}, 6)
+
+    def test_subscriptions(self):
+        Follow.objects.create(user=self.user, author=self.recipe.author)
+        for recipes_limit in PAGE_SIZES:
+            shared_cache().clear()
+            with self.subTest(recipes_limit=recipes_limit):
+                with self.assertNumQueries(4):
+                    response = self.client.get(
+                        "/api/users/subscriptions/",
+                        {"recipes_limit": recipes_limit},
+                    )
+                self.assertEqual(
+                    len(response.data["results"][0]["recipes"]),
+                    recipes_limit,
+                )
+
+    def test_list_flags(self):
+        response = self.client.get("/api/recipes/")
+        for recipe in response.data["results"]:
+            self.assertTrue(recipe["is_favorited"])
+            self.assertTrue(recipe["is_in_shopping_cart"])
+
+    def test_retrieve(self):
+        with self.assertNumQueries(5):
+            response = self.client.get(f"/api/recipes/{self.recipe.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["is_favorited"])
+        self.assertTrue(response.data["is_in_shopping_cart"])
+
+
+@override_settings(CACHES=CACHES)
+class CartTotalsTest(TestCase):
+    def setUp(self):
+        shared_cache().clear()
+        self.author, *self.users = (
+            User.objects.create_user(
+                username=name, email=f"{name}@example.com",
+                password="password", first_name="Имя", last_name="Фамилия",
+            )
+            for name in ("author", "first", "second", "third")
+        )
+        self.ingredients = [
+            Ingredient.objects.create(
+                name=f"ингредиент {number}", measurement_unit="г"
+            )
+            for number in range(3)
+        ]
+        self.shared, self.other = (
+            Recipe.objects.create(
+                author=self.author, name=name, text="Текст",
+                image="recipes/test.png", cooking_time=10,
+            )
+            for name in ("Общий", "Другой")
+        )
+        first, second, third = self.ingredients
+        IngredientRecipe.objects.bulk_create((
+            IngredientRecipe(recipe=self.shared, ingredient=first, amount=10),
+            IngredientRecipe(recipe=self.shared, ingredient=second, amount=5),
+            IngredientRecipe(recipe=self.other, ingredient=first, amount=3),
+        ))
+        for user in self.users:
+            add_recipes(ShoppingCart, user, [self.shared.id])
+        add_recipes(ShoppingCart, self.users[0], [self.other.id])
+
+    def expected_totals(self):
+        totals = defaultdict(lambda: defaultdict(int))
+        for user_id, recipe_id in ShoppingCart.objects.values_list(
+            "user_id", "recipe_id"
+        ):
+            for ingredient_id, amount in IngredientRecipe.objects.filter(
+                recipe_id=recipe_id
+            ).values_list("ingredient_id", "amount"):
+                totals[user_id][ingredient_id] += amount
+        return {user_id: dict(amounts) for user_id, amounts in totals.items()}
+
+    def assert_totals(self):
+        expected = self.expected_totals()
+        stored = defaultdict(dict)
+        for user_id, ingredient_id, total_amount in (
+            ShoppingCartTotal.objects.values_list(
+                "user_id", "ingredient_id", "total_amount"
+            )
+        ):
+            stored[user_id][ingredient_id] = total_amount
+        self.assertEqual(dict(stored), expected)
+        self.assertEqual(dict(calculate_cart_totals()), expected)
+        first = self.users[0].id
+        self.assertEqual(
+            dict(calculate_cart_totals([first])),
+            {
+                user_id: amounts for user_id, amounts in expected.items()
+                if user_id == first
+            },
+        )
+
+    def test_shared_recipe(self):
+        self.assert_totals()
+        rebuild_cart_totals([user.id for user in self.users[:2]])
+        self.assert_totals()
+
+    def test_ingredient_edit(self):
+        first, _, third = self.ingredients
+        client = APIClient()
+        client.force_authenticate(self.author)
+        response = client.patch(
+            f"/api/recipes/{self.shared.id}/",
+            {"ingredients": [
+                {"id": first.id, "amount": 4},
+                {"id": third.id, "amount": 7},
+            ]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assert_totals()
+
+    def test_recipe_deletion(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        response = client.delete(f"/api/recipes/{self.other.id}/")
+        self.assertEqual(response.status_code, 204)
+        self.assert_totals()
+        RecipeAdmin(Recipe, site).delete_queryset(
+            None, Recipe.objects.filter(id=self.shared.id)
+        )
+        self.assert_totals()
+        self.assertFalse(ShoppingCartTotal.objects.exists())
+
+
+@override_settings(CACHES=CACHES)
+class RecipesCountTest(TestCase):
+    def setUp(self):
+        shared_cache().clear()
+        self.author = User.objects.create_user(
+            username="author", email="author@example.com",
+            password="password", first_name="Имя", last_name="Фамилия",
+        )
+        self.recipes = [
+            Recipe.objects.create(
+                author=self.author, name=f"Рецепт {number}", text="Текст",
+                image="recipes/test.png", cooking_time=10,
+            )
+            for number in range(4)
+        ]
+
+    def assert_recipes_count(self):
+        self.author.refresh_from_db()
+        self.assertEqual(
+            self.author.recipes_count, self.author.recipes.count()
+        )
+
+    def test_api_and_admin_deletion(self):
+        self.assert_recipes_count()
+        client = APIClient()
+        client.force_authenticate(self.author)
+        response = client.delete(f"/api/recipes/{self.recipes[0].id}/")
+        self.assertEqual(response.status_code, 204)
+        self.assert_recipes_count()
+        admin = RecipeAdmin(Recipe, site)
+        admin.delete_model(None, self.recipes[1])
+        self.assert_recipes_count()
+        admin.delete_queryset(None, Recipe.objects.filter(
+            id__in=[recipe.id for recipe in self.recipes[2:]]
+        ))
+        self.assert_recipes_count()
+        self.assertEqual(self.author.recipes_count, 0)
+
+
+@override_settings(CACHES=CACHES)
+class BulkEndpointsTest(TestCase):
+    def setUp(self):
+        shared_cache().clear()
+        self.user, self.author, self.other = (
+            User.objects.create_user(
+                username=name, email=f"{name}@example.com",
+                password="password", first_name="Имя", last_name="Фамилия",
+            )
+            for name in ("user", "author", "other")
+        )
+        ingredient = Ingredient.objects.create(
+            name="ингредиент", measurement_unit="г"
+        )
+        self.first, self.second = (
+            Recipe.objects.create(
+                author=self.author, name=name, text="Текст",
+                image="recipes/test.png", cooking_time=10,
+            )
+            for name in ("Первый", "Второй")
+        )
+        for recipe in (self.first, self.second):
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=10
+            )
+        self.missing = self.second.id + 100
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def bulk(self, method, url, data):
+        response = getattr(self.client, method)(url, data, format="json")
+        self.assertEqual(response.status_code, 200)
+        return {
+            result["id"]: result["status"]
+            for result in response.data["results"]
+        }
+
+    def assert_counter(self, obj, field, value):
+        obj.refresh_from_db()
+        self.assertEqual(getattr(obj, field), value)
+
+    def test_favorites(self):
+        add_recipes(Favorite, self.user, [self.first.id])
+        ids = [self.first.id, self.second.id, self.missing, self.second.id]
+        self.assertEqual(
+            self.bulk("post", "/api/recipes/favorite/", {"ids": ids}),
+            {
+                self.first.id: "exists",
+                self.second.id: "created",
+                self.missing: "not_found",
+            },
+        )
+        self.assert_counter(self.first, "favorites_count", 1)
+        self.assert_counter(self.second, "favorites_count", 1)
+        self.assertEqual(
+            self.bulk("delete", "/api/recipes/favorite/", {"ids": ids}),
+            {
+                self.first.id: "deleted",
+                self.second.id: "deleted",
+                self.missing: "not_found",
+            },
+        )
+        self.assertEqual(
+            self.bulk(
+                "delete", "/api/recipes/favorite/", {"ids": [self.first.id]}
+            ),
+            {self.first.id: "missing"},
+        )
+        self.assert_counter(self.first, "favorites_count", 0)
+        self.assert_counter(self.second, "favorites_count", 0)
+
+    def test_shopping_cart(self):
+        add_recipes(ShoppingCart, self.user, [self.first.id])
+        self.assertEqual(
+            self.bulk(
+                "post", "/api/recipes/shopping_cart/",
+                {"author": self.author.id},
+            ),
+            {self.first.id: "exists", self.second.id: "created"},
+        )
+        self.assert_counter(self.first, "in_carts_count", 1)
+        self.assert_counter(self.second, "in_carts_count", 1)
+        self.assertEqual(
+            list(self.user.cart_totals.values_list(
+                "total_amount", flat=True
+            )),
+            [20],
+        )
+        self.assertEqual(
+            self.bulk(
+                "delete", "/api/recipes/shopping_cart/",
+                {"ids": [self.first.id, self.missing]},
+            ),
+            {self.first.id: "deleted", self.missing: "not_found"},
+        )
+        self.assertEqual(
+            self.bulk("delete", "/api/recipes/shopping_cart/", {}),
+            {self.second.id: "deleted"},
+        )
+        self.assert_counter(self.first, "in_carts_count", 0)
+        self.assert_counter(self.second, "in_carts_count", 0)
+        self.assertFalse(self.user.cart_totals.exists())
+
+    def test_subscriptions(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        User.objects.filter(id=self.author.id).update(followers_count=1)
+        # Встречная подписка: счетчик пользователя меняет другой запрос.
+        add_follows(self.other, [self.user.id])
+        ids = [self.author.id, self.other.id, self.user.id, self.missing]
+        self.assertEqual(
+            self.bulk("post", "/api/users/subscribe/", {"ids": ids}),
+            {
+                self.author.id: "exists",
+                self.other.id: "created",
+                self.user.id: "self",
+                self.missing: "not_found",
+            },
+        )
+        self.assert_counter(self.author, "followers_count", 1)
+        self.assert_counter(self.other, "followers_count", 1)
+        self.assert_counter(self.user, "followers_count", 1)
+        self.assertEqual(
+            self.bulk("delete", "/api/users/subscribe/", {"ids": ids}),
+            {
+                self.author.id: "deleted",
+                self.other.id: "deleted",
+                self.user.id: "missing",
+                self.missing: "not_found",
+            },
+        )
+        self.assert_counter(self.author, "followers_count", 0)
+        self.assert_counter(self.other, "followers_count", 0)
+        self.assert_counter(self.user, "followers_count", 1)
+
+
+@override_settings(CACHES=CACHES)
+class RecipeConditionalTest(TestCase):
+    def setUp(self):
+        shared_cache().clear()
+        local_cache.clear()
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password",
+            first_name="Имя", last_name="Фамилия",
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.user, name="Рецепт", text="Текст",
+            image="recipes/test.png", cooking_time=10,
+        )
+        self.url = f"/api/recipes/{self.recipe.id}/"
+
+    def test_anonymous_last_modified(self):
+        response = self.client.get(self.url)
+        self.assertIn("Last-Modified", response)
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_user_flags_not_hidden_by_if_modified_since(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(self.url)
+        self.assertNotIn("Last-Modified", response)
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        response = client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["is_favorited"])
+
+
+@override_settings(CACHES=CACHES)
+class RecipeSearchTest(TestCase):
+    def setUp(self):
+        shared_cache().clear()
+        local_cache.clear()
+        author = User.objects.create_user(
+            username="author", email="author@example.com",
+            password="password", first_name="Имя", last_name="Фамилия",
+        )
+        self.borscht, self.soup = (
+            Recipe.objects.create(
+                author=author, name=name, text=text,
+                image="recipes/test.png", cooking_time=10,
+            )
+            for name, text in (
+                ("borscht", "beet stew"),
+                ("soup", "lighter than borscht"),
+            )
+        )
+        update_search_vectors()
+
+    def test_search_keeps_relevance_order(self):
+        response = self.client.get("/api/recipes/", {"search": "borscht"})
+        self.assertEqual(
+            [recipe["id"] for recipe in response.data["results"]],
+            [self.borscht.id, self.soup.id],
+        )
+
+    def test_search_with_explicit_ordering(self):
+        response = self.client.get(
+            "/api/recipes/", {"search": "borscht", "ordering": "-id"}
+        )
+        self.assertEqual(
+            [recipe["id"] for recipe in response.data["results"]],
+            [self.soup.id, self.borscht.id],
+        )
+
+
+@override_settings(CACHES=CACHES)
+class PaginationCountTest(TestCase):
+    def setUp(self):
+        shared_cache().clear()
+        local_cache.clear()
+        self.author = User.objects.create_user(
+            username="author", email="author@example.com",
+            password="password", first_name="Имя", last_name="Фамилия",
+        )
+        self.tag = Tag.objects.create(
+            name="Завтрак", color="#E26C2D", slug="breakfast"
+        )
+        self.recipes = [
+            Recipe.objects.create(
+                author=self.author, name=f"Рецепт {number}", text="Текст",
+                image="recipes/test.png", cooking_time=10,
+            )
+            for number in range(2)
+        ]
+
+    def get_count(self, **params):
+        return self.client.get("/api/recipes/", params).data["count"]
+
+    def test_new_recipe_resets_count(self):
+        self.assertEqual(self.get_count(author=self.author.id), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(
+                author=self.author, name="Рецепт 2", text="Текст",
+                image="recipes/test.png", cooking_time=10,
+            )
+        self.assertEqual(self.get_count(author=self.author.id), 3)
+
+    def test_subquery_table_change_resets_count(self):
+        self.assertEqual(self.get_count(tags="breakfast"), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[0].tags.add(self.tag)
+        self.assertEqual(self.get_count(tags="breakfast"), 1)
+
+
+class AsyncRecipeListTest(TestCase):
+    def test_page_below_one(self):
+        request = AsyncRequestFactory().get("/api/recipes/?page=0")
+        response = async_to_sync(RecipeListView().as_view())(request)
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=CACHES)
+class TokenCacheTest(TestCase):
+    def setUp(self):
+        shared_cache().clear()
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password",
+            first_name="Имя", last_name="Фамилия",
+        )
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=self.user)}"
+        )
+
+    def test_bulk_deactivation_drops_cached_token(self):
+        self.assertEqual(self.client.get("/api/users/me/").status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(id=self.user.id).update(is_active=False)
+        self.assertEqual(self.client.get("/api/users/me/").status_code, 401)
+
+
+@override_settings(
+    ROOT_URLCONF=__name__, CACHES=CACHES, DATABASE_REPLICAS=[],
+    PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1,
+)
+class AsyncProfilingTest(TestCase):
+    async def test_executor_queries_and_serialization(self):
+        response = await AsyncClient().get("/api/recipes/")
+        self.assertEqual(response.status_code, 200)
+        timing = response["Server-Timing"]
+        self.assertNotIn('"0 queries"', timing)
+        self.assertIn("serialize;dur=", timing)
+
+    async def test_requests_run_concurrently(self):
+        started = time.monotonic()
+        responses = await asyncio.gather(*(
+            AsyncClient().get("/api/slow/") for _ in range(4)
+        ))
+        self.assertLess(time.monotonic() - started, SLOW_VIEW_SECONDS * 2)
+        for response in responses:
+            self.assertIn("total;dur=", response["Server-Timing"])
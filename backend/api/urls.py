@@ -1,8 +1,9 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework import routers
 
 from .views import (FavoriteViewSet, FollowViewSet, IngredientListView,
-                    RecipeViewSet, CartViewSet, TagViewSet,
+                    MetricsView, RecipeViewSet, CartViewSet, TagViewSet,
                     SelfUserViewSet)
 
 app_name = "api"
@@ -14,6 +15,14 @@ router.register("recipes", RecipeViewSet)
 
 urlpatterns = [
     path("auth/", include("djoser.urls.authtoken")),
+    path("recipes/favorite/", FavoriteViewSet.as_view(actions={
+        "post": "bulk_create",
+        "delete": "bulk_destroy",
+    })),
+    path("recipes/shopping_cart/", CartViewSet.as_view(actions={
+        "post": "bulk_create",
+        "delete": "bulk_destroy",
+    })),
     path("recipes/<int:id>/favorite/", FavoriteViewSet.as_view(actions={
         "post": "create",
         "delete": "destroy",
@@ -28,6 +37,10 @@ urlpatterns = [
     path("users/subscriptions/", FollowViewSet.as_view(actions={
         "get": "list",
     })),
+    path("users/subscribe/", FollowViewSet.as_view(actions={
+        "post": "bulk_create",
+        "delete": "bulk_destroy",
+    })),
     path("users/me/", SelfUserViewSet.as_view(actions={
         "get": "retrieve",
     })),
@@ -35,6 +48,21 @@ urlpatterns = [
         "post": "create",
         "delete": "destroy",
     })),
+    path("_metrics/", MetricsView.as_view()),
     path("", include("djoser.urls")),
     path("", include(router.urls)),
 ]
+
+if settings.ASYNC_READ_VIEWS:
+    from . import async_views
+
+    urlpatterns = [
+        path("recipes/", async_views.RecipeListView().as_view()),
+        path(
+            "recipes/<int:pk>/", async_views.RecipeDetailView().as_view()
+        ),
+        path("users/subscriptions/",
+             async_views.SubscriptionListView().as_view()),
+        path("tags/", async_views.TagListView().as_view()),
+        path("ingredients/", async_views.IngredientSearchView().as_view()),
+    ] + urlpatterns
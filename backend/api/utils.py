@@ -1,16 +1,199 @@
-def all_ingredients_in_text(ingredients_recipes):
-    shopping_cart = {}
-    for ingredient_recipe in ingredients_recipes:
-        if ingredient_recipe.ingredient.name in shopping_cart:
-            shopping_cart[
-                ingredient_recipe.ingredient.name
-            ][1] += ingredient_recipe.amount
-        else:
-            shopping_cart[ingredient_recipe.ingredient.name] = [
-                ingredient_recipe.ingredient.measurement_unit,
-                ingredient_recipe.amount,
-            ]
-    content = ""
-    for ingredient, values in shopping_cart.items():
-        content += f"{ingredient} ({values[0]}) — {values[1]}\n"
-    return content
+import binascii
+import csv
+import io
+import os
+import tempfile
+import weakref
+
+from django.conf import settings
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            UploadedFile)
+from django.db import transaction
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from foodgram_backend.db.replicas import use_primary
+from recipes.cache import shared_cache
+from recipes.models import ShoppingCartTotal
+from users.models import Follow
+
+BASE64_CHUNK_SIZE = 64 * 1024
+FOLLOWED_AUTHORS_KEY = "followed-authors:{}"
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+PDF_MARGIN = 40
+PDF_FONT_SIZE = 12
+PDF_LINE_HEIGHT = 18
+
+
+def forget_followed_authors(user_id):
+    key = FOLLOWED_AUTHORS_KEY.format(user_id)
+    transaction.on_commit(lambda: shared_cache().delete(key))
+
+
+def get_followed_author_ids(request):
+    if not request.user.is_authenticated:
+        return set()
+    if not hasattr(request, "followed_author_ids"):
+        key = FOLLOWED_AUTHORS_KEY.format(request.user.id)
+        author_ids = shared_cache().get(key)
+        if author_ids is None:
+            with use_primary():
+                author_ids = set(
+                    Follow.objects.filter(user=request.user).values_list(
+                        "author_id", flat=True
+                    )
+                )
+            shared_cache().set(
+                key, author_ids, settings.AUTH_CACHE_TIMEOUT
+            )
+        request.followed_author_ids = author_ids
+    return request.followed_author_ids
+
+
+def remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class TemporaryImageUpload(UploadedFile):
+    def __init__(self, size):
+        file = tempfile.NamedTemporaryFile(
+            suffix=".upload", dir=settings.FILE_UPLOAD_TEMP_DIR, delete=False
+        )
+        super().__init__(file, "temp", "image", size, None)
+        # Хранилище перемещает файл при сохранении, а если сохранения не
+        # было, временный файл удаляется вместе с объектом.
+        weakref.finalize(self, remove_file, file.name)
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def sniff_image_type(header):
+    for signature, image_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_type
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def check_image_header(header):
+    image_type = sniff_image_type(header)
+    if image_type is None:
+        raise ValueError("Файл не является изображением.")
+    try:
+        width, height = Image.open(io.BytesIO(header)).size
+    except Exception:
+        # Заголовок не поместился в первый блок, полная проверка
+        # изображения выполняется позже в ImageField.
+        return image_type
+    if width * height > settings.MAX_IMAGE_PIXELS:
+        raise ValueError("Слишком большое разрешение изображения.")
+    return image_type
+
+
+def decode_base64_image(data, start):
+    size = (len(data) - start) * 3 // 4
+    if size > settings.MAX_IMAGE_UPLOAD_SIZE:
+        raise ValueError("Изображение слишком большое.")
+    if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+        upload = TemporaryImageUpload(size)
+    else:
+        upload = InMemoryUploadedFile(
+            io.BytesIO(), None, "temp", "image", size, None
+        )
+    image_type = None
+    try:
+        for position in range(start, len(data), BASE64_CHUNK_SIZE):
+            chunk = binascii.a2b_base64(
+                data[position:position + BASE64_CHUNK_SIZE]
+            )
+            if image_type is None:
+                image_type = check_image_header(chunk)
+            upload.file.write(chunk)
+    except (binascii.Error, ValueError):
+        upload.close()
+        raise
+    if image_type is None:
+        upload.close()
+        raise ValueError("Файл не является изображением.")
+    upload.size = upload.file.tell()
+    upload.name = f"temp.{image_type}"
+    upload.content_type = f"image/{image_type}"
+    upload.file.seek(0)
+    return upload
+
+
+def get_recipes_limit(request):
+    limit = request.query_params.get("recipes_limit", "")
+    return int(limit) if limit.isdigit() else None
+
+
+def shopping_cart_ingredients(user):
+    return ShoppingCartTotal.objects.filter(user=user).values(
+        "ingredient__name", "ingredient__measurement_unit", "total_amount"
+    ).order_by("ingredient__name")
+
+
+def shopping_cart_txt(ingredients):
+    for ingredient in ingredients.iterator():
+        yield (
+            f"{ingredient['ingredient__name']} "
+            f"({ingredient['ingredient__measurement_unit']}) "
+            f"— {ingredient['total_amount']}\n"
+        )
+
+
+def shopping_cart_csv(ingredients):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(("Ингредиент", "Единица измерения", "Количество"))
+    for ingredient in ingredients.iterator():
+        writer.writerow((
+            ingredient["ingredient__name"],
+            ingredient["ingredient__measurement_unit"],
+            ingredient["total_amount"],
+        ))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def shopping_cart_pdf(ingredients):
+    font = "Helvetica"
+    if os.path.exists(settings.SHOPPING_CART_PDF_FONT):
+        font = "ShoppingCartFont"
+        pdfmetrics.registerFont(
+            TTFont(font, settings.SHOPPING_CART_PDF_FONT)
+        )
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    y = height - PDF_MARGIN
+    for line in shopping_cart_txt(ingredients):
+        if y < PDF_MARGIN:
+            pdf.showPage()
+            y = height - PDF_MARGIN
+        pdf.setFont(font, PDF_FONT_SIZE)
+        pdf.drawString(PDF_MARGIN, y, line.rstrip("\n"))
+        y -= PDF_LINE_HEIGHT
+    pdf.save()
+    yield buffer.getvalue()
+
+
+SHOPPING_CART_FORMATS = {
+    "txt": (shopping_cart_txt, "text/plain; charset=utf-8"),
+    "csv": (shopping_cart_csv, "text/csv; charset=utf-8"),
+    "pdf": (shopping_cart_pdf, "application/pdf"),
+}
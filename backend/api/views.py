@@ -1,76 +1,272 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Prefetch, Subquery
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action
-from rest_framework.filters import SearchFilter
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import (
-    IsAuthenticated, IsAuthenticatedOrReadOnly
+    AllowAny, IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
 )
 from rest_framework.response import Response
 from rest_framework.status import (
     HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST
 )
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet, ViewSet
 
+from foodgram_backend.db.pool import render_metrics
+from recipes.cache import (
+    author_namespace, get_or_set, get_version, recipe_namespace
+)
 from recipes.models import (
-    Favorite, Ingredient, IngredientRecipe, Recipe, ShoppingCart, Tag
+    Favorite, Ingredient, IngredientRecipe, Recipe, ShoppingCart,
+    SimilarRecipe, Tag, TrendingRecipe, UserRecommendation
+)
+from recipes.autocomplete import search_ingredients
+from recipes.matching import match_index
+from recipes.services import (
+    EXISTS, MISSING, NOT_FOUND, SELF, add_follows, add_recipes,
+    clear_cart, lock_cart_users, rebuild_cart_totals, remove_follows,
+    remove_recipes
 )
 from users.models import Follow, User
-from .filters import RecipeFilter
+from .filters import RecipeFilter, RecipeOrderingFilter
+from .mixins import CachedListMixin
+from .paginations import CursorOptInPagination
 from .permissions import IsAuthorPatchDelete
+from .profiling import metrics, serialize
 from .serializers import (
-    CustomUserSerializer, FavoriteSerializer, FollowSerializer,
-    IngredientSerializer, RecipeCreateUpdateSerializer, RecipeSerializer,
+    BulkIdsSerializer, CartBulkSerializer, CustomUserSerializer,
+    FavoriteSerializer, FollowSerializer,
+    IngredientSerializer, RecipeCreateUpdateSerializer,
+    RecipeImageSerializer, RecipeSerializer,
     ShoppingCartSerializer, TagSerializer
 )
-from .utils import all_ingredients_in_text
+from .utils import (
+    SHOPPING_CART_FORMATS, forget_followed_authors, get_recipes_limit,
+    shopping_cart_ingredients
+)
+
+RECIPE_USER_FLAGS = ("is_favorited", "is_in_shopping_cart", "is_subscribed")
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(CachedListMixin, ReadOnlyModelViewSet):
+    cache_namespace = "tags"
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
 
-class IngredientListView(ReadOnlyModelViewSet):
+class IngredientListView(CachedListMixin, ReadOnlyModelViewSet):
+    cache_namespace = "ingredients"
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     permission_classes = [IsAuthenticatedOrReadOnly]
-    filter_backends = [SearchFilter]
-    search_fields = ["^name"]
+
+    def get_list_data(self, request, *args, **kwargs):
+        name = request.query_params.get("name")
+        if not name:
+            return super().get_list_data(request, *args, **kwargs)
+        limit = request.query_params.get("limit", "")
+        if not limit.isdigit():
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        return search_ingredients(
+            name, min(int(limit), settings.INGREDIENT_SEARCH_LIMIT)
+        )
 
 
 class RecipeViewSet(ModelViewSet):
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.select_related("author").defer("search_vector")
     permission_classes = (IsAuthorPatchDelete,)
-    filter_backends = (DjangoFilterBackend,)
+    pagination_class = CursorOptInPagination
+    filter_backends = (DjangoFilterBackend, RecipeOrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ("id", "favorites_count", "in_carts_count")
+    ordering = ("-id",)
 
     def get_serializer_class(self):
-        if self.action in ["create", "update"]:
+        if self.action in ["create", "update", "partial_update"]:
             return RecipeCreateUpdateSerializer
         return RecipeSerializer
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            user_ids = lock_cart_users([instance.id])
+            instance.delete()
+            rebuild_cart_totals(user_ids)
+
+    def get_queryset(self):
+        return self.queryset.with_user_flags(self.request.user)
+
     def retrieve(self, request, pk=None):
-        instance = get_object_or_404(self.queryset, pk=pk)
-        serializer = RecipeSerializer(instance, context={"request": request})
-        return Response(serializer.data)
+        flags = get_object_or_404(
+            self.get_queryset().annotate(
+                is_subscribed=Exists(Follow.objects.filter(
+                    user=request.user.id, author=OuterRef("author_id")
+                ))
+            ).values("id", "author_id", *RECIPE_USER_FLAGS),
+            pk=pk,
+        )
+        pk = flags["id"]
+        versions = [
+            get_version(namespace) for namespace in (
+                recipe_namespace(pk), author_namespace(flags["author_id"]),
+                "tags", "ingredients",
+            )
+        ]
+        etag = '"recipe-{}-{}"'.format(pk, hashlib.md5("-".join(
+            [str(version["version"]) for version in versions]
+            + [str(int(flags[field])) for field in RECIPE_USER_FLAGS]
+        ).encode()).hexdigest())
+        # Флаги пользователя меняются без смены версий рецепта, поэтому
+        # Last-Modified отдается только анонимам, у которых их нет.
+        last_modified = None
+        if not request.user.is_authenticated:
+            last_modified = int(
+                max(version["modified"] for version in versions)
+            )
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            data = get_or_set(
+                recipe_namespace(pk),
+                "{}:{}".format(
+                    request.build_absolute_uri("/"),
+                    ":".join(
+                        str(version["version"]) for version in versions[1:]
+                    ),
+                ),
+                lambda: self.anonymous_detail_data(pk),
+            )
+            response = Response(dict(
+                data,
+                is_favorited=flags["is_favorited"],
+                is_in_shopping_cart=flags["is_in_shopping_cart"],
+                author=dict(
+                    data["author"], is_subscribed=flags["is_subscribed"]
+                ),
+            ))
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+        response["ETag"] = etag
+        patch_vary_headers(response, ("Authorization",))
+        return response
 
-    def list(self, request):
-        queryset = self.filter_queryset(self.queryset.prefetch_related(
+    def anonymous_detail_data(self, pk):
+        instance = get_object_or_404(
+            self.queryset.with_user_flags(AnonymousUser()).prefetch_related(
+                Prefetch(
+                    "ingredients_recipes",
+                    IngredientRecipe.objects.select_related("ingredient"),
+                ),
+                "tags",
+            ),
+            pk=pk,
+        )
+        data = serialize(
+            RecipeSerializer(instance, context={"request": self.request})
+        )
+        # Подписка зависит от пользователя и подставляется при ответе.
+        return dict(data, author=dict(data["author"], is_subscribed=False))
+
+    def get_list_queryset(self):
+        return self.filter_queryset(self.get_queryset().prefetch_related(
             "ingredients_recipes__ingredient", "tags"
         ))
+
+    def list(self, request):
+        return self.paginated_response(self.get_list_queryset())
+
+    def paginated_response(self, queryset):
         page = self.paginate_queryset(queryset)
         serializer = self.get_serializer(
-            page, many=True, context={"request": request}
+            page, many=True, context={"request": self.request}
         )
-        return self.get_paginated_response(serializer.data)
+        return self.get_paginated_response(serialize(serializer))
+
+    def ranked_response(self, recipe_ids):
+        return self.paginated_response(
+            self.get_queryset().prefetch_related(
+                "ingredients_recipes__ingredient", "tags"
+            ).in_order(list(recipe_ids))
+        )
+
+    @action(
+        detail=True,
+        methods=["patch"],
+        url_path="image",
+        parser_classes=(MultiPartParser,),
+        permission_classes=(IsAuthenticated, IsAuthorPatchDelete),
+    )
+    def upload_image(self, request, pk=None):
+        serializer = RecipeImageSerializer(
+            self.get_object(), data=request.data,
+            context={"request": request},
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serialize(serializer))
+
+    @action(detail=False, permission_classes=(AllowAny,))
+    def match(self, request):
+        ingredient_ids = [
+            pk
+            for value in request.query_params.getlist("ingredients")
+            for pk in value.split(",")
+        ]
+        missing = request.query_params.get("missing", "0")
+        if not all(pk.isdigit() for pk in ingredient_ids + [missing]):
+            return Response(
+                {"errors": "Укажите id ингредиентов и допустимое "
+                           "число недостающих"},
+                status=HTTP_400_BAD_REQUEST,
+            )
+        return self.ranked_response(match_index.match(
+            [int(pk) for pk in ingredient_ids], int(missing)
+        ))
+
+    @action(detail=False, permission_classes=(AllowAny,))
+    def trending(self, request):
+        return self.ranked_response(
+            TrendingRecipe.objects.values_list("recipe_id", flat=True)
+        )
+
+    @action(detail=False, permission_classes=(AllowAny,))
+    def recommended(self, request):
+        source = request.query_params.get("recipe", "")
+        if source.isdigit():
+            return self.ranked_response(SimilarRecipe.objects.filter(
+                source_id=source
+            ).values_list("recipe_id", flat=True))
+        if request.user.is_authenticated:
+            recipe_ids = list(UserRecommendation.objects.filter(
+                user=request.user
+            ).values_list("recipe_id", flat=True))
+            if recipe_ids:
+                return self.ranked_response(recipe_ids)
+        return self.trending(request)
+
+
+def bulk_response(statuses):
+    return Response({
+        "results": [
+            {"id": pk, "status": status} for pk, status in statuses.items()
+        ]
+    })
 
 
 class FavoriteViewSet(ModelViewSet):
@@ -79,27 +275,42 @@ class FavoriteViewSet(ModelViewSet):
 
     def create(self, request, id):
         recipe = get_object_or_404(Recipe, id=id)
-        queryset = Favorite.objects.filter(user=request.user, recipe=recipe)
-        if queryset.exists():
+        if add_recipes(
+            Favorite, request.user, [recipe.id]
+        )[recipe.id] == EXISTS:
             return Response(
                 {"errors": "Рецепт уже в избранном"},
                 status=HTTP_400_BAD_REQUEST,
             )
-        instance = Favorite.objects.create(user=request.user, recipe=recipe)
-        serializer = self.get_serializer(instance)
+        serializer = self.get_serializer(
+            Favorite(user=request.user, recipe=recipe)
+        )
         return Response(serializer.data, status=HTTP_201_CREATED)
 
     def destroy(self, request, id):
-        recipe = get_object_or_404(Recipe, id=id)
-        queryset = Favorite.objects.filter(user=request.user, recipe=recipe)
-        if queryset.exists():
-            instance = queryset.first()
-            instance.delete()
-            return Response(status=HTTP_204_NO_CONTENT)
-        return Response(
-            {"errors": "Рецепт не был в избранном"},
-            status=HTTP_400_BAD_REQUEST,
-        )
+        status = remove_recipes(Favorite, request.user, [id])[id]
+        if status == NOT_FOUND:
+            raise Http404
+        if status == MISSING:
+            return Response(
+                {"errors": "Рецепт не был в избранном"},
+                status=HTTP_400_BAD_REQUEST,
+            )
+        return Response(status=HTTP_204_NO_CONTENT)
+
+    def bulk_create(self, request):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return bulk_response(add_recipes(
+            Favorite, request.user, serializer.validated_data["ids"]
+        ))
+
+    def bulk_destroy(self, request):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return bulk_response(remove_recipes(
+            Favorite, request.user, serializer.validated_data["ids"]
+        ))
 
 
 class CartViewSet(ModelViewSet):
@@ -108,78 +319,177 @@ class CartViewSet(ModelViewSet):
 
     def create(self, request, id):
         recipe = get_object_or_404(Recipe, id=id)
-        queryset = ShoppingCart.objects.filter(
-            user=request.user, recipe=recipe
-        )
-        if queryset.exists():
+        if add_recipes(
+            ShoppingCart, request.user, [recipe.id]
+        )[recipe.id] == EXISTS:
             return Response(
                 {"errors": "Рецепт уже в корзине"},
                 status=HTTP_400_BAD_REQUEST,
             )
-        instance = ShoppingCart.objects.create(
-            user=request.user, recipe=recipe
+        serializer = self.get_serializer(
+            ShoppingCart(user=request.user, recipe=recipe)
         )
-        serializer = self.get_serializer(instance)
         return Response(serializer.data, status=HTTP_201_CREATED)
 
     def destroy(self, request, id):
-        recipe = get_object_or_404(Recipe, id=id)
-        queryset = ShoppingCart.objects.filter(
-            user=request.user, recipe=recipe
+        status = remove_recipes(ShoppingCart, request.user, [id])[id]
+        if status == NOT_FOUND:
+            raise Http404
+        if status == MISSING:
+            return Response(
+                {"errors": "Рецепта не было в корзине"},
+                status=HTTP_400_BAD_REQUEST,
+            )
+        return Response(status=HTTP_204_NO_CONTENT)
+
+    def get_bulk_ids(self, request):
+        serializer = CartBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if "author" not in serializer.validated_data:
+            return serializer.validated_data.get("ids")
+        author = get_object_or_404(
+            User, id=serializer.validated_data["author"]
         )
-        if queryset.exists():
-            instance = queryset.first()
-            instance.delete()
-            return Response(status=HTTP_204_NO_CONTENT)
-        return Response(
-            {"errors": "Рецепта не было в корзине"},
-            status=HTTP_400_BAD_REQUEST,
+        return list(author.recipes.values_list("id", flat=True))
+
+    def bulk_create(self, request):
+        recipe_ids = self.get_bulk_ids(request)
+        if recipe_ids is None:
+            return Response(
+                {"errors": "Укажите список рецептов или автора"},
+                status=HTTP_400_BAD_REQUEST,
+            )
+        return bulk_response(
+            add_recipes(ShoppingCart, request.user, recipe_ids)
+        )
+
+    def bulk_destroy(self, request):
+        recipe_ids = self.get_bulk_ids(request)
+        if recipe_ids is None:
+            return bulk_response(clear_cart(request.user))
+        return bulk_response(
+            remove_recipes(ShoppingCart, request.user, recipe_ids)
         )
 
     def retrieve(self, request):
-        ingredients_recipes = IngredientRecipe.objects.filter(
-            recipe__cart__user=request.user
+        file_type = request.query_params.get("type", "txt")
+        if file_type not in SHOPPING_CART_FORMATS:
+            return Response(
+                {"errors": "Неподдерживаемый формат файла"},
+                status=HTTP_400_BAD_REQUEST,
+            )
+        writer, content_type = SHOPPING_CART_FORMATS[file_type]
+        response = StreamingHttpResponse(
+            writer(shopping_cart_ingredients(request.user)),
+            content_type=content_type,
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="shopping_cart.{file_type}"'
         )
-        content = all_ingredients_in_text(ingredients_recipes)
-        return HttpResponse(content, content_type="text/plain")
+        return response
 
 
 class FollowViewSet(ModelViewSet):
     queryset = Follow.objects.all()
     serializer_class = FollowSerializer
+    pagination_class = CursorOptInPagination
+
+    def get_list_queryset(self):
+        recipes = Recipe.objects.only(
+            "id", "author_id", "name", "image", "image_thumb", "cooking_time"
+        )
+        limit = get_recipes_limit(self.request)
+        if limit is not None:
+            recipes = recipes.filter(id__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef("author")
+                ).order_by("-id").values("id")[:limit]
+            ))
+        return Follow.objects.filter(
+            user=self.request.user
+        ).select_related("author").annotate(
+            recipes_count=Count("author__recipes")
+        ).prefetch_related(
+            Prefetch("author__recipes", recipes, to_attr="limited_recipes")
+        ).order_by("-id")
 
     @action(
         detail=False, methods=["get"], permission_classes=[IsAuthenticated]
     )
     def list(self, request):
-        queryset = Follow.objects.filter(user=request.user)
-        page = self.paginate_queryset(queryset)
+        page = self.paginate_queryset(self.get_list_queryset())
         serializer = FollowSerializer(
             page, many=True, context={"request": request}
         )
-        return self.get_paginated_response(serializer.data)
+        return self.get_paginated_response(serialize(serializer))
 
     @action(
         detail=True, methods=["post"], permission_classes=[IsAuthenticated]
     )
     def create(self, request, id):
         user = get_object_or_404(User, id=id)
-        data = Follow.objects.create(user=request.user, author=user)
-        serializer = FollowSerializer(data, context={"request": request})
+        status = add_follows(request.user, [user.id])[user.id]
+        if status == SELF:
+            return Response(
+                {"errors": "Самоподписка запрещена"},
+                status=HTTP_400_BAD_REQUEST,
+            )
+        if status == EXISTS:
+            return Response(
+                {"errors": "Вы уже подписаны"},
+                status=HTTP_400_BAD_REQUEST,
+            )
+        forget_followed_authors(request.user.id)
+        serializer = FollowSerializer(
+            Follow(user=request.user, author=user),
+            context={"request": request},
+        )
         return Response(serializer.data, status=HTTP_201_CREATED)
 
     @action(
         detail=True, methods=["delete"], permission_classes=[IsAuthenticated]
     )
     def destroy(self, request, id):
-        user = get_object_or_404(User, id=id)
-        Follow.objects.get(user=request.user, author=user).delete()
+        status = remove_follows(request.user, [id])[id]
+        if status == NOT_FOUND:
+            raise Http404
+        if status == MISSING:
+            return Response(
+                {"errors": "У вас нет подписки на этого пользователя"},
+                status=HTTP_400_BAD_REQUEST,
+            )
         return Response(status=HTTP_204_NO_CONTENT)
 
+    def bulk_create(self, request):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        statuses = add_follows(
+            request.user, serializer.validated_data["ids"]
+        )
+        forget_followed_authors(request.user.id)
+        return bulk_response(statuses)
+
+    def bulk_destroy(self, request):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return bulk_response(remove_follows(
+            request.user, serializer.validated_data["ids"]
+        ))
+
 
 class SelfUserViewSet(ViewSet):
     def retrieve(self, request):
         serializer = CustomUserSerializer(
             request.user, context={"request": request}
         )
-        return Response(serializer.data)
+        return Response(serialize(serializer))
+
+
+class MetricsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return HttpResponse(
+            metrics.render() + render_metrics(),
+            content_type="text/plain; version=0.0.4",
+        )
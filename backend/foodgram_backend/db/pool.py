@@ -0,0 +1,328 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from functools import partial
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.utils import OperationalError
+
+AGE_BUCKETS = (1, 10, 60, 300, 900, 1800, 3600, 7200)
+COUNTERS = (
+    ("opened", "foodgram_db_connections_opened_total",
+     "Открыто соединений с базой."),
+    ("connect_seconds", "foodgram_db_connect_seconds_total",
+     "Время установки соединений с базой."),
+    ("checkouts", "foodgram_db_pool_checkouts_total",
+     "Выдано соединений из пула."),
+    ("waits", "foodgram_db_pool_waits_total",
+     "Ожидания свободного соединения в пуле."),
+    ("wait_seconds", "foodgram_db_pool_wait_seconds_total",
+     "Время ожидания свободного соединения в пуле."),
+    ("timeouts", "foodgram_db_pool_timeouts_total",
+     "Запросы, не дождавшиеся соединения из пула."),
+)
+
+_lock = threading.Lock()
+_pools = {}
+_stats = {}
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {key: 0 for key, _, _ in COUNTERS}
+        self.ages = [0] * (len(AGE_BUCKETS) + 1)
+        self.ages_sum = 0
+
+    def add(self, **values):
+        with self.lock:
+            for key, value in values.items():
+                self.counters[key] += value
+
+    def closed(self, age):
+        with self.lock:
+            self.ages[bisect_left(AGE_BUCKETS, age)] += 1
+            self.ages_sum += age
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters, closed=sum(self.ages))
+
+
+class ConnectionPool:
+    def __init__(self, key, stats, options):
+        self.key = key
+        self.stats = stats
+        self.max_size = options["MAX_SIZE"]
+        self.timeout = options.get("TIMEOUT", 5)
+        self.max_age = options.get("MAX_AGE", 1800)
+        self.max_idle = options.get("MAX_IDLE", 300)
+        self.check_idle = options.get("CHECK_IDLE", 10)
+        self.condition = threading.Condition()
+        self.idle = deque()
+        self.size = 0
+        self.closed = False
+
+    def checkout(self, connect, ping):
+        started = time.monotonic()
+        waited = False
+        with self.condition:
+            while not self.idle and self.size >= self.max_size:
+                waited = True
+                remaining = started + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    self.stats.add(
+                        waits=1, wait_seconds=self.timeout, timeouts=1
+                    )
+                    raise PoolTimeout(
+                        f"Нет свободного соединения с базой за "
+                        f"{self.timeout} с (размер пула {self.max_size})"
+                    )
+                self.condition.wait(remaining)
+            if self.idle:
+                item = self.idle.pop()
+            else:
+                item = None
+                self.size += 1
+        self.stats.add(
+            checkouts=1, waits=int(waited),
+            wait_seconds=time.monotonic() - started if waited else 0,
+        )
+        if item is not None:
+            connection, created_at, returned_at = item
+            now = time.monotonic()
+            # Долго простоявшее соединение могло оборваться на стороне
+            # базы, поэтому перед выдачей его проверяем.
+            if now - created_at < self.max_age and (
+                now - returned_at < self.check_idle or ping(connection)
+            ):
+                return connection, created_at
+            self.discard(connection, created_at)
+        try:
+            return connect()
+        except BaseException:
+            self.release()
+            raise
+
+    def checkin(self, connection, created_at, reset):
+        now = time.monotonic()
+        if (
+            not self.closed
+            and now - created_at < self.max_age
+            and reset(connection)
+        ):
+            expired = []
+            with self.condition:
+                # Самые давно не использованные соединения лежат в начале
+                # очереди: после пика нагрузки пул сжимается.
+                while self.idle and now - self.idle[0][2] > self.max_idle:
+                    expired.append(self.idle.popleft())
+                    self.size -= 1
+                self.idle.append((connection, created_at, now))
+                self.condition.notify()
+            for old_connection, old_created_at, _ in expired:
+                self.discard(old_connection, old_created_at)
+            return
+        self.discard(connection, created_at)
+        self.release()
+
+    def release(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def discard(self, connection, created_at):
+        self.stats.closed(time.monotonic() - created_at)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, deque()
+            self.size -= len(idle)
+        for connection, created_at, _ in idle:
+            self.discard(connection, created_at)
+
+
+def get_stats(alias):
+    with _lock:
+        return _stats.setdefault(alias, ConnectionStats())
+
+
+def get_pool(alias, settings_dict):
+    options = settings_dict.get("POOL") or {}
+    if not options.get("MAX_SIZE"):
+        return None
+    if settings_dict.get("CONN_MAX_AGE"):
+        raise ImproperlyConfigured(
+            f"База {alias}: POOL несовместим с CONN_MAX_AGE, соединения "
+            f"и так возвращаются в пул в конце запроса"
+        )
+    key = tuple(
+        settings_dict.get(name) for name in ("NAME", "HOST", "PORT", "USER")
+    )
+    stale = None
+    with _lock:
+        pool = _pools.get(alias)
+        # Тестовый раннер меняет NAME на лету: соединения к старой базе
+        # переиспользовать нельзя.
+        if pool is None or pool.key != key:
+            stale = pool
+            pool = _pools[alias] = ConnectionPool(
+                key, _stats.setdefault(alias, ConnectionStats()), options
+            )
+    if stale is not None:
+        stale.close()
+    return pool
+
+
+def close_pools():
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+class PooledDatabaseWrapperMixin:
+    # В Django 3.2 нет ни CONN_HEALTH_CHECKS, ни встроенного пула
+    # соединений: добавляем оба поверх стандартного бэкенда.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+        self.connection_pool = None
+        self.connection_created_at = None
+
+    @property
+    def health_check_enabled(self):
+        return self.settings_dict.get("CONN_HEALTH_CHECKS", False)
+
+    def pool_supported(self):
+        return True
+
+    def get_new_connection(self, conn_params):
+        connect = partial(self.open_connection, conn_params)
+        pool = None
+        if self.pool_supported():
+            pool = get_pool(self.alias, self.settings_dict)
+        if pool is None:
+            connection, self.connection_created_at = connect()
+        else:
+            connection, self.connection_created_at = pool.checkout(
+                connect, self.ping_connection
+            )
+        self.connection_pool = pool
+        return connection
+
+    def open_connection(self, conn_params):
+        started = time.monotonic()
+        connection = super().get_new_connection(conn_params)
+        now = time.monotonic()
+        get_stats(self.alias).add(opened=1, connect_seconds=now - started)
+        return connection, now
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def ping_connection(self, connection):
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT 1")
+            finally:
+                cursor.close()
+        except self.Database.Error:
+            return False
+        return True
+
+    def reset_connection(self, connection):
+        # Незавершенная транзакция не должна достаться следующему запросу.
+        try:
+            connection.rollback()
+        except self.Database.Error:
+            return False
+        return True
+
+    def _close(self):
+        if self.connection is None:
+            return None
+        pool, self.connection_pool = self.connection_pool, None
+        if pool is None:
+            if self.connection_created_at is not None:
+                get_stats(self.alias).closed(
+                    time.monotonic() - self.connection_created_at
+                )
+            return super()._close()
+        connection, self.connection = self.connection, None
+        pool.checkin(
+            connection, self.connection_created_at, self.reset_connection
+        )
+        return None
+
+    def close_if_unusable_or_obsolete(self):
+        self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
+
+    def close_if_health_check_failed(self):
+        if (
+            self.connection is None
+            or not self.health_check_enabled
+            or self.health_check_done
+        ):
+            return
+        # Постоянное соединение могло оборваться между запросами:
+        # проверяем его один раз перед первым запросом к базе.
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
+
+
+def render_metrics():
+    with _lock:
+        items = sorted(_stats.items())
+        pools = sorted(_pools.items())
+    lines = []
+    for key, name, help_text in COUNTERS:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for alias, stats in items:
+            lines.append(f'{name}{{alias="{alias}"}} {stats.counters[key]}')
+    name = "foodgram_db_connection_age_seconds"
+    lines.append(f"# HELP {name} Время жизни закрытых соединений.")
+    lines.append(f"# TYPE {name} histogram")
+    for alias, stats in items:
+        with stats.lock:
+            ages, ages_sum = list(stats.ages), stats.ages_sum
+        cumulative = 0
+        for bound, count in zip(AGE_BUCKETS + ("+Inf",), ages):
+            cumulative += count
+            lines.append(
+                f'{name}_bucket{{alias="{alias}",le="{bound}"}} {cumulative}'
+            )
+        lines.append(f'{name}_sum{{alias="{alias}"}} {ages_sum}')
+        lines.append(f'{name}_count{{alias="{alias}"}} {cumulative}')
+    name = "foodgram_db_pool_connections"
+    lines.append(f"# HELP {name} Соединения в пуле.")
+    lines.append(f"# TYPE {name} gauge")
+    for alias, pool in pools:
+        with pool.condition:
+            idle, size = len(pool.idle), pool.size
+        lines.append(f'{name}{{alias="{alias}",state="idle"}} {idle}')
+        lines.append(
+            f'{name}{{alias="{alias}",state="in_use"}} {size - idle}'
+        )
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,17 @@
+from django.db.backends.postgresql.base import \
+    DatabaseWrapper as PostgresDatabaseWrapper
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from ..pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, PostgresDatabaseWrapper):
+    def reset_connection(self, connection):
+        if connection.closed:
+            return False
+        try:
+            if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except self.Database.Error:
+            return False
+        return True
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE")
+
+# Реплика, с которой читает текущий запрос; None - основная база.
+read_alias = ContextVar("read_alias", default=None)
+_unavailable_until = {}
+
+
+@contextmanager
+def use_primary():
+    token = read_alias.set(None)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+def mark_unavailable(alias):
+    logger.warning(
+        "Реплика %s недоступна, чтение с основной базы %s с",
+        alias, settings.REPLICA_RETRY_SECONDS,
+    )
+    _unavailable_until[alias] = (
+        time.monotonic() + settings.REPLICA_RETRY_SECONDS
+    )
+
+
+def is_available(alias):
+    return _unavailable_until.get(alias, 0) <= time.monotonic()
+
+
+def choose_replica():
+    # Соединение здесь не открывается: async-представления читают
+    # из других потоков, и проверка идет там, где выполняется запрос.
+    aliases = [
+        alias for alias in settings.DATABASE_REPLICAS if is_available(alias)
+    ]
+    return random.choice(aliases) if aliases else None
+
+
+def connect_replica(alias):
+    connection = connections[alias]
+    try:
+        if hasattr(connection, "close_if_health_check_failed"):
+            connection.close_if_health_check_failed()
+        connection.ensure_connection()
+    except OperationalError:
+        mark_unavailable(alias)
+        return False
+    return True
+
+
+def pin_primary_on_write(execute, sql, params, many, context):
+    # После записи запрос до конца читает с основной базы. Роутер для
+    # этого не годится: db_for_write Django вызывает и без записи,
+    # например при присваивании внешнего ключа несохраненному объекту.
+    if (
+        read_alias.get() is not None
+        and sql.lstrip()[:6].upper() in WRITE_STATEMENTS
+    ):
+        read_alias.set(None)
+    return execute(sql, params, many, context)
+
+
+def install_write_pin(connection, **kwargs):
+    # execute_wrapper действует только на соединения текущего потока.
+    if (
+        connection.alias == DEFAULT_DB_ALIAS
+        and pin_primary_on_write not in connection.execute_wrappers
+    ):
+        connection.execute_wrappers.append(pin_primary_on_write)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = read_alias.get()
+        # Внутри транзакции читаем то, что в ней же и записано,
+        # а select_for_update на реплике невозможен.
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if not is_available(alias) or not connect_replica(alias):
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        connection_created.connect(
+            install_write_pin, dispatch_uid="install_write_pin"
+        )
+        install_write_pin(connections[DEFAULT_DB_ALIAS])
+        # Под ASGI синхронная прослойка выполнялась бы в одном потоке
+        # и выстраивала бы все запросы в очередь.
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token = read_alias.set(self.choose_alias(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        return self.pin_primary(request, response)
+
+    async def __acall__(self, request):
+        token = read_alias.set(self.choose_alias(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        return self.pin_primary(request, response)
+
+    def choose_alias(self, request):
+        alias = None
+        if (
+            request.method in SAFE_METHODS
+            and request.path.startswith(settings.REPLICA_PATH_PREFIX)
+            and settings.REPLICA_PIN_COOKIE not in request.COOKIES
+        ):
+            alias = choose_replica()
+        request.read_alias = alias
+        return alias
+
+    def pin_primary(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            # Пока реплики догоняют запись, клиент читает с основной базы.
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, "1",
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True, samesite="Lax",
+            )
+        return response
+
+    def process_exception(self, request, exception):
+        alias = getattr(request, "read_alias", None)
+        if (
+            alias is None
+            or not isinstance(exception, OperationalError)
+            or not connections[alias].errors_occurred
+        ):
+            return None
+        mark_unavailable(alias)
+        connections[alias].close()
+        match = request.resolver_match
+        if asyncio.iscoroutinefunction(match.func):
+            return None
+        # Чтение можно безопасно повторить на основной базе.
+        with use_primary():
+            return match.func(request, *match.args, **match.kwargs)
@@ -0,0 +1,10 @@
+from django.db.backends.sqlite3.base import \
+    DatabaseWrapper as SQLiteDatabaseWrapper
+
+from ..pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, SQLiteDatabaseWrapper):
+    def pool_supported(self):
+        # Каждое соединение с базой в памяти - отдельная база.
+        return not self.is_in_memory_db()
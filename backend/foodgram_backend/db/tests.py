@@ -0,0 +1,242 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.db import OperationalError, connections
+from django.http import HttpResponse, JsonResponse
+from django.test import AsyncClient, SimpleTestCase, override_settings
+from django.urls import path
+
+from recipes.models import Recipe, Tag
+from users.models import User
+from . import replicas
+from .pool import ConnectionPool, ConnectionStats, PoolTimeout, close_pools
+from .sqlite3.base import DatabaseWrapper
+
+SLOW_VIEW_SECONDS = 0.2
+
+
+def read_view(request):
+    alias = replicas.ReplicaRouter().db_for_read(Recipe)
+    return JsonResponse({"alias": alias})
+
+
+def build_view(request):
+    Recipe(author=User())
+    return read_view(request)
+
+
+def update_view(request):
+    Tag.objects.filter(id=0).update(name="")
+    return read_view(request)
+
+
+def write_view(request):
+    return HttpResponse(status=201)
+
+
+async def slow_view(request):
+    await asyncio.sleep(SLOW_VIEW_SECONDS)
+    return JsonResponse({"alias": replicas.read_alias.get()})
+
+
+urlpatterns = [
+    path("api/read/", read_view),
+    path("api/build/", build_view),
+    path("api/update/", update_view),
+    path("api/write/", write_view),
+    path("api/slow/", slow_view),
+]
+
+
+@override_settings(
+    ROOT_URLCONF=__name__, DATABASE_REPLICAS=["replica_1"],
+    PROFILING_ENABLED=False,
+)
+class ReplicaRoutingTest(SimpleTestCase):
+    databases = {"default"}
+
+    def setUp(self):
+        replicas._unavailable_until.clear()
+        self.addCleanup(replicas._unavailable_until.clear)
+
+    @mock.patch.object(replicas, "connect_replica", return_value=True)
+    def test_safe_read_uses_replica(self, connect_replica):
+        response = self.client.get("/api/read/")
+        self.assertEqual(response.json()["alias"], "replica_1")
+        connect_replica.assert_called_with("replica_1")
+
+    @mock.patch.object(replicas, "connect_replica", return_value=True)
+    def test_write_pins_primary(self, connect_replica):
+        response = self.client.post("/api/write/")
+        self.assertIn(replicas.settings.REPLICA_PIN_COOKIE, response.cookies)
+        response = self.client.get("/api/read/")
+        self.assertEqual(response.json()["alias"], "default")
+
+    @mock.patch.object(replicas, "connect_replica", return_value=True)
+    def test_unsaved_instance_keeps_replica(self, connect_replica):
+        response = self.client.get("/api/build/")
+        self.assertEqual(response.json()["alias"], "replica_1")
+
+    @mock.patch.object(replicas, "connect_replica", return_value=True)
+    def test_write_switches_request_to_primary(self, connect_replica):
+        response = self.client.get("/api/update/")
+        self.assertEqual(response.json()["alias"], "default")
+
+    def test_unavailable_replica_falls_back_to_primary(self):
+        replica = mock.Mock()
+        replica.ensure_connection.side_effect = OperationalError
+        with mock.patch.object(replicas, "connections", {
+            "default": connections["default"], "replica_1": replica,
+        }):
+            response = self.client.get("/api/read/")
+        self.assertEqual(response.json()["alias"], "default")
+        self.assertFalse(replicas.is_available("replica_1"))
+        self.assertIsNone(replicas.choose_replica())
+
+    async def test_async_requests_run_concurrently(self):
+        started = time.monotonic()
+        responses = await asyncio.gather(*(
+            AsyncClient().get("/api/slow/") for _ in range(4)
+        ))
+        self.assertLess(time.monotonic() - started, SLOW_VIEW_SECONDS * 2)
+        for response in responses:
+            self.assertEqual(response.json()["alias"], "replica_1")
+
+
+class FakeConnection:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def connect():
+    return FakeConnection(), time.monotonic()
+
+
+def reset(connection):
+    return True
+
+
+def ping(connection):
+    return True
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def make_pool(self, **options):
+        return ConnectionPool(
+            None, ConnectionStats(), {"MAX_SIZE": 1, **options}
+        )
+
+    def test_returned_connection_is_reused(self):
+        pool = self.make_pool()
+        connection, created_at = pool.checkout(connect, ping)
+        pool.checkin(connection, created_at, reset)
+        self.assertIs(pool.checkout(connect, ping)[0], connection)
+        self.assertEqual(pool.stats.snapshot()["checkouts"], 2)
+
+    def test_waits_for_returned_connection(self):
+        pool = self.make_pool(TIMEOUT=5)
+        connection, created_at = pool.checkout(connect, ping)
+        timer = threading.Timer(
+            0.05, pool.checkin, (connection, created_at, reset)
+        )
+        timer.start()
+        self.addCleanup(timer.join)
+        self.assertIs(pool.checkout(connect, ping)[0], connection)
+        self.assertEqual(pool.stats.snapshot()["waits"], 1)
+
+    def test_timeout_when_exhausted(self):
+        pool = self.make_pool(TIMEOUT=0.05)
+        pool.checkout(connect, ping)
+        with self.assertRaises(PoolTimeout):
+            pool.checkout(connect, ping)
+        self.assertEqual(pool.stats.snapshot()["timeouts"], 1)
+
+    def test_failed_reset_discards_connection(self):
+        pool = self.make_pool()
+        connection, created_at = pool.checkout(connect, ping)
+        pool.checkin(connection, created_at, lambda connection: False)
+        self.assertTrue(connection.closed)
+        self.assertEqual((pool.size, len(pool.idle)), (0, 0))
+        self.assertEqual(pool.stats.snapshot()["closed"], 1)
+
+    def test_expired_connection_is_discarded(self):
+        pool = self.make_pool(MAX_AGE=0)
+        connection, created_at = pool.checkout(connect, ping)
+        pool.checkin(connection, created_at, reset)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_idle_connection_failing_ping_is_replaced(self):
+        pool = self.make_pool(CHECK_IDLE=0)
+        connection, created_at = pool.checkout(connect, ping)
+        pool.checkin(connection, created_at, reset)
+        replacement, _ = pool.checkout(connect, lambda connection: False)
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size, 1)
+
+
+class PooledDatabaseWrapperTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(close_pools)
+        self.settings_dict = {
+            "ENGINE": "foodgram_backend.db.sqlite3",
+            "NAME": os.path.join(directory, "pool.sqlite3"),
+            "USER": "", "PASSWORD": "", "HOST": "", "PORT": "",
+            "ATOMIC_REQUESTS": False, "AUTOCOMMIT": True,
+            "CONN_MAX_AGE": 0, "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {}, "TIME_ZONE": None, "TEST": {},
+            "POOL": {"MAX_SIZE": 1},
+        }
+
+    def make_wrapper(self):
+        wrapper = DatabaseWrapper(dict(self.settings_dict), "pool_test")
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_close_returns_connection_to_pool(self):
+        first = self.make_wrapper()
+        first.ensure_connection()
+        connection = first.connection
+        first.close()
+        self.assertIsNone(first.connection)
+        second = self.make_wrapper()
+        second.ensure_connection()
+        self.assertIs(second.connection, connection)
+
+    def test_open_transaction_is_rolled_back_on_return(self):
+        first = self.make_wrapper()
+        with first.cursor() as cursor:
+            cursor.execute("CREATE TABLE item (id integer)")
+        first.connection.execute("BEGIN")
+        first.connection.execute("INSERT INTO item VALUES (1)")
+        first.close()
+        second = self.make_wrapper()
+        with second.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM item")
+            self.assertEqual(cursor.fetchone(), (0,))
+        self.assertFalse(second.connection.in_transaction)
+
+    def test_reset_reports_failed_rollback(self):
+        wrapper = self.make_wrapper()
+        connection = mock.Mock()
+        connection.rollback.side_effect = wrapper.Database.Error
+        self.assertFalse(wrapper.reset_connection(connection))
+
+    def test_failed_health_check_drops_connection(self):
+        wrapper = self.make_wrapper()
+        wrapper.ensure_connection()
+        wrapper.health_check_done = False
+        with mock.patch.object(wrapper, "is_usable", return_value=False):
+            wrapper.close_if_health_check_failed()
+        self.assertIsNone(wrapper.connection)
+        self.assertTrue(wrapper.health_check_done)
@@ -1,6 +1,6 @@
 from pathlib import Path
 
-from decouple import config
+from decouple import Csv, config
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -24,9 +24,12 @@ INSTALLED_APPS = [
     "rest_framework.authtoken",
     "djoser",
     "django_filters",
+    "django.contrib.postgres",
 ]
 
 MIDDLEWARE = [
+    "api.profiling.ProfilingMiddleware",
+    "foodgram_backend.db.replicas.ReplicaMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -57,20 +60,115 @@ TEMPLATES = [
 WSGI_APPLICATION = "foodgram_backend.wsgi.application"
 
 
+# Пул соединений внутри процесса; 0 - пул выключен
+DB_POOL_SIZE = config("DB_POOL_SIZE", 0, cast=int)
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": "foodgram_backend.db.postgresql",
         "NAME": config("POSTGRES_DB", "django"),
         "USER": config("POSTGRES_USER", "django"),
         "PASSWORD": config("POSTGRES_PASSWORD", ""),
         "HOST": config("DB_HOST", "django"),
-        "PORT": config("DB_PORT", 5432)
+        "PORT": config("DB_PORT", 5432),
+        # С пулом соединения возвращаются в него в конце каждого запроса
+        "CONN_MAX_AGE": 0 if DB_POOL_SIZE else config(
+            "DB_CONN_MAX_AGE", 60, cast=int
+        ),
+        "CONN_HEALTH_CHECKS": config(
+            "DB_HEALTH_CHECKS", "True"
+        ).lower() == "true",
+        "POOL": {
+            "MAX_SIZE": DB_POOL_SIZE,
+            "TIMEOUT": config("DB_POOL_TIMEOUT", 5, cast=float),
+            "MAX_AGE": 30 * 60,
+            "MAX_IDLE": 5 * 60,
+            "CHECK_IDLE": 10,
+        },
+    }
+}
+
+# Реплики для чтения: хосты через запятую (host или host:port),
+# учетные данные и база те же, что у основной
+DATABASE_REPLICAS = []
+
+for number, address in enumerate(
+    config("DB_REPLICA_HOSTS", "", cast=Csv()), 1
+):
+    host, _, port = address.partition(":")
+    DATABASES[f"replica_{number}"] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        "OPTIONS": {"connect_timeout": 2},
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica_{number}")
+
+DATABASE_ROUTERS = ["foodgram_backend.db.replicas.ReplicaRouter"]
+
+# Безопасные запросы к API читают с реплик, кроме клиентов, которые
+# недавно что-то записали: их читает основная база
+REPLICA_PATH_PREFIX = "/api/"
+
+REPLICA_PIN_COOKIE = "db_primary"
+
+REPLICA_PIN_SECONDS = config("DB_REPLICA_PIN_SECONDS", 5, cast=int)
+
+# Сколько секунд не обращаться к недоступной реплике
+REPLICA_RETRY_SECONDS = 30
+
+CACHES = {
+    "default": {
+        "BACKEND": config(
+            "CACHE_BACKEND",
+            "django.core.cache.backends.filebased.FileBasedCache",
+        ),
+        "LOCATION": config("CACHE_LOCATION", str(BASE_DIR / "cache")),
     }
 }
 
+REFERENCE_CACHE_ALIAS = "default"
+
+REFERENCE_CACHE_TIMEOUT = config(
+    "REFERENCE_CACHE_TIMEOUT", 60 * 60 * 24, cast=int
+)
+
+REFERENCE_CACHE_LOCAL_SIZE = 128
+
+INGREDIENT_SEARCH_BACKEND = config("INGREDIENT_SEARCH_BACKEND", "memory")
+
+INGREDIENT_SEARCH_LIMIT = 50
+
+INGREDIENT_SEARCH_SIMILARITY = 0.3
+
+RECIPE_SEARCH_CONFIG = "russian"
+
+RECIPE_SEARCH_LIMIT = 1000
+
+MATCH_LIMIT = 500
+
+PAGINATION_COUNT_CACHE_TIMEOUT = 30
+
+PAGINATION_ESTIMATE_THRESHOLD = 10000
+
+TRENDING_SIZE = 100
+
+TRENDING_WINDOW_DAYS = 14
+
+TRENDING_HALF_LIFE_HOURS = 48
+
+RECOMMENDATIONS_TOP_K = 30
+
+RECOMMENDATIONS_BATCH_SIZE = 500
+
+RECOMMENDATIONS_CONTENT_WEIGHT = 0.3
+
+RECOMMENDATIONS_MAX_FEATURE_SHARE = 0.2
+
 # DATABASES = {
 #     'default': {
-#         'ENGINE': 'django.db.backends.sqlite3',
+#         'ENGINE': 'foodgram_backend.db.sqlite3',
 #         'NAME': BASE_DIR / 'db.sqlite3',
 #     }
 # }
@@ -111,11 +209,48 @@ MEDIA_URL = "/media/"
 
 MEDIA_ROOT = BASE_DIR / "media"
 
+MAX_IMAGE_UPLOAD_SIZE = 10 * 1024 * 1024
+
+MAX_IMAGE_PIXELS = 40_000_000
+
+IMAGE_VARIANTS = {
+    "image_thumb": (320, 320),
+    "image_medium": (960, 960),
+}
+
+IMAGE_VARIANT_FORMAT = config("IMAGE_VARIANT_FORMAT", "WEBP")
+
+IMAGE_VARIANT_QUALITY = 80
+
+IMAGE_WORKERS = config("IMAGE_WORKERS", 2, cast=int)
+
+IMAGE_PROCESSING_SYNC = config(
+    "IMAGE_PROCESSING_SYNC", "False"
+).lower() == "true"
+
+# Асинхронные представления для чтения (только при запуске через ASGI)
+ASYNC_READ_VIEWS = config("ASYNC_READ_VIEWS", "False").lower() == "true"
+ASYNC_DB_THREADS = config("ASYNC_DB_THREADS", 8, cast=int)
+
+AUTH_CACHE_TIMEOUT = config("AUTH_CACHE_TIMEOUT", 60, cast=int)
+
+PROFILING_ENABLED = config("PROFILING_ENABLED", "False").lower() == "true"
+PROFILING_SAMPLE_RATE = config("PROFILING_SAMPLE_RATE", 0.1, cast=float)
+PROFILING_QUERY_BUDGET = config("PROFILING_QUERY_BUDGET", 30, cast=int)
+PROFILING_LATENCY_BUDGET_MS = config(
+    "PROFILING_LATENCY_BUDGET_MS", 500, cast=int
+)
+
+SHOPPING_CART_PDF_FONT = config(
+    "SHOPPING_CART_PDF_FONT",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+)
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework.authentication.TokenAuthentication",
+        "api.authentication.CachedTokenAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
@@ -1,7 +1,13 @@
 from django.contrib import admin
+from django.db import transaction
 
+from .cache import bump_version
+from .images import schedule_image_processing
 from .models import (Favorite, Ingredient, IngredientRecipe, Recipe,
                      ShoppingCart, Tag, TagRecipe)
+from .search import update_search_vectors
+from .services import (change_recipe_cart_totals, lock_cart_users,
+                       rebuild_cart_totals, recipe_amounts)
 
 
 class IngredientRecipeInline(admin.TabularInline):
@@ -17,13 +23,42 @@ class TagRecipeInline(admin.TabularInline):
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ("name", "author", "favorite_count")
+    list_display = ("name", "author", "favorite_count", "in_carts_count")
     search_fields = ("name", "author__email", "tags")
     list_filter = ("author", "tags")
     inlines = [IngredientRecipeInline, TagRecipeInline]
 
+    def save_model(self, request, obj, form, change):
+        if change:
+            lock_cart_users([obj.id])
+        super().save_model(request, obj, form, change)
+        if "image" in form.changed_data:
+            schedule_image_processing(obj.id)
+
+    def save_related(self, request, form, formsets, change):
+        old_amounts = recipe_amounts([form.instance.id]) if change else {}
+        super().save_related(request, form, formsets, change)
+        if change:
+            change_recipe_cart_totals(
+                form.instance.id, old_amounts,
+                recipe_amounts([form.instance.id]),
+            )
+        update_search_vectors([form.instance.id])
+        bump_version("recipe_ingredients")
+
+    def delete_model(self, request, obj):
+        user_ids = lock_cart_users([obj.id])
+        super().delete_model(request, obj)
+        rebuild_cart_totals(user_ids)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            user_ids = lock_cart_users(queryset.values("id"))
+            super().delete_queryset(request, queryset)
+            rebuild_cart_totals(user_ids)
+
     def favorite_count(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
+        return obj.favorites_count
 
     favorite_count.short_description = "В Избранном у:"
 
@@ -0,0 +1,114 @@
+import bisect
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .indexes import SnapshotIndex
+from .models import Ingredient
+
+EXACT, PREFIX, SUBSTRING, FUZZY = range(4)
+
+
+def trigrams(text):
+    text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class IngredientIndex(SnapshotIndex):
+    namespace = "ingredients"
+
+    def build(self):
+        rows = sorted(
+            (name.lower(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in (
+                Ingredient.objects.values_list(
+                    "id", "name", "measurement_unit"
+                ).iterator()
+            )
+        )
+        index = defaultdict(list)
+        for position, row in enumerate(rows):
+            for trigram in trigrams(row[0]):
+                index[trigram].append(position)
+        return [row[0] for row in rows], rows, dict(index)
+
+    def search(self, query, limit):
+        keys, rows, trigram_index = self.snapshot()
+        query = query.lower().strip()
+        if not query:
+            return []
+        ranked = []
+        seen = set()
+        start = bisect.bisect_left(keys, query)
+        for position in range(start, len(keys)):
+            if not keys[position].startswith(query):
+                break
+            rank = EXACT if keys[position] == query else PREFIX
+            ranked.append((rank, len(keys[position]), position))
+            seen.add(position)
+        ranked.sort()
+        if len(ranked) < limit:
+            substring = [
+                (SUBSTRING, key.find(query), position)
+                for position, key in enumerate(keys)
+                if position not in seen and query in key
+            ]
+            substring.sort()
+            ranked.extend(substring)
+            seen.update(position for _, _, position in substring)
+        if len(ranked) < limit:
+            ranked.extend(self.fuzzy(query, seen, keys, trigram_index))
+        return [
+            {"id": rows[position][1], "name": rows[position][2],
+             "measurement_unit": rows[position][3]}
+            for _, _, position in ranked[:limit]
+        ]
+
+    def fuzzy(self, query, seen, keys, trigram_index):
+        query_trigrams = trigrams(query)
+        common = defaultdict(int)
+        for trigram in query_trigrams:
+            for position in trigram_index.get(trigram, ()):
+                common[position] += 1
+        matches = []
+        for position, count in common.items():
+            if position in seen:
+                continue
+            similarity = count / (
+                len(query_trigrams) + len(trigrams(keys[position]))
+                - count
+            )
+            if similarity >= settings.INGREDIENT_SEARCH_SIMILARITY:
+                matches.append((FUZZY, -similarity, position))
+        matches.sort()
+        return matches
+
+
+ingredient_index = IngredientIndex()
+
+
+def postgres_search(query, limit):
+    return list(
+        Ingredient.objects.filter(
+            Q(name__icontains=query) | Q(name__trigram_similar=query)
+        ).annotate(
+            rank=Case(
+                When(name__iexact=query, then=Value(EXACT)),
+                When(name__istartswith=query, then=Value(PREFIX)),
+                When(name__icontains=query, then=Value(SUBSTRING)),
+                default=Value(FUZZY),
+                output_field=IntegerField(),
+            ),
+            similarity=TrigramSimilarity("name", query),
+        ).order_by(
+            "rank", "-similarity", "name"
+        ).values("id", "name", "measurement_unit")[:limit]
+    )
+
+
+def search_ingredients(query, limit):
+    if settings.INGREDIENT_SEARCH_BACKEND == "postgres":
+        return postgres_search(query, limit)
+    return ingredient_index.search(query, limit)
@@ -0,0 +1,94 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from foodgram_backend.db.replicas import use_primary
+
+VERSION_KEY = "reference-version:{}"
+
+
+class LocalLRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_cache = LocalLRUCache(settings.REFERENCE_CACHE_LOCAL_SIZE)
+
+
+def recipe_namespace(recipe_id):
+    return f"recipe:{recipe_id}"
+
+
+def author_namespace(user_id):
+    return f"author:{user_id}"
+
+
+def table_namespace(table):
+    return f"table:{table}"
+
+
+def shared_cache():
+    return caches[settings.REFERENCE_CACHE_ALIAS]
+
+
+def get_version(namespace):
+    key = VERSION_KEY.format(namespace)
+    version = shared_cache().get(key)
+    if version is None:
+        shared_cache().add(
+            key, {"version": time.time_ns(), "modified": time.time()}, None
+        )
+        version = shared_cache().get(key)
+    return version
+
+
+def bump_version(namespace):
+    transaction.on_commit(lambda: shared_cache().set(
+        VERSION_KEY.format(namespace),
+        {"version": time.time_ns(), "modified": time.time()},
+        None,
+    ))
+
+
+def get_or_set(namespace, key, default):
+    version = get_version(namespace)["version"]
+    digest = hashlib.md5(key.encode()).hexdigest()
+    full_key = f"reference:{namespace}:{version}:{digest}"
+    value = local_cache.get(full_key)
+    if value is not None:
+        return value
+    value = shared_cache().get(full_key)
+    if value is None:
+        # В общий кеш не должны попасть данные с отстающей реплики.
+        with use_primary():
+            value = default()
+        shared_cache().set(
+            full_key, value, settings.REFERENCE_CACHE_TIMEOUT
+        )
+    local_cache.set(full_key, value)
+    return value
@@ -0,0 +1,94 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .cache import bump_version, recipe_namespace
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg"}
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix="recipe-images",
+        )
+    return _executor
+
+
+def render_variant(image, size):
+    variant = image.copy()
+    variant.thumbnail(size, Image.LANCZOS)
+    image_format = settings.IMAGE_VARIANT_FORMAT
+    if image_format == "JPEG" and variant.mode != "RGB":
+        variant = variant.convert("RGB")
+    buffer = io.BytesIO()
+    # Метаданные (EXIF, ICC и т.п.) не передаются в save и не сохраняются.
+    variant.save(
+        buffer, image_format, quality=settings.IMAGE_VARIANT_QUALITY
+    )
+    return buffer.getvalue()
+
+
+def process_recipe_image(recipe_id):
+    try:
+        recipe = Recipe.objects.only(
+            "image", "image_thumb", "image_medium"
+        ).get(pk=recipe_id)
+        with recipe.image.open("rb") as file:
+            image = ImageOps.exif_transpose(Image.open(file))
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            stem = os.path.splitext(os.path.basename(recipe.image.name))[0]
+            extension = EXTENSIONS[settings.IMAGE_VARIANT_FORMAT]
+            variants = {
+                field: default_storage.save(
+                    f"recipes/{field}/{stem}.{extension}",
+                    ContentFile(render_variant(image, size)),
+                )
+                for field, size in settings.IMAGE_VARIANTS.items()
+            }
+        updated = Recipe.objects.filter(
+            pk=recipe_id, image=recipe.image.name
+        ).update(**variants)
+        if updated:
+            bump_version(recipe_namespace(recipe_id))
+        obsolete = (
+            [getattr(recipe, field).name for field in variants]
+            if updated else list(variants.values())
+        )
+        for name in obsolete:
+            if name:
+                default_storage.delete(name)
+    except Exception:
+        logger.exception("Не удалось обработать изображение рецепта %s",
+                         recipe_id)
+
+
+def process_in_worker(recipe_id):
+    try:
+        process_recipe_image(recipe_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_image_processing(recipe_id):
+    if settings.IMAGE_PROCESSING_SYNC:
+        transaction.on_commit(lambda: process_recipe_image(recipe_id))
+    else:
+        transaction.on_commit(
+            lambda: get_executor().submit(process_in_worker, recipe_id)
+        )
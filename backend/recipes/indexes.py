@@ -0,0 +1,27 @@
+import threading
+
+from .cache import get_version
+
+
+class SnapshotIndex:
+    # Индекс в памяти процесса, который перестраивается при смене версии
+    # пространства имен кеша. Снимок публикуется одним присваиванием,
+    # поэтому параллельный запрос видит либо старый, либо новый целиком.
+    namespace = None
+
+    def __init__(self):
+        self.version = None
+        self.state = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        raise NotImplementedError
+
+    def snapshot(self):
+        version = get_version(self.namespace)["version"]
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    self.state = self.build()
+                    self.version = version
+        return self.state
@@ -0,0 +1,222 @@
+import json
+import subprocess
+import time
+from contextlib import ExitStack
+from itertools import cycle
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe
+from users.models import User
+
+COMPARED_METRICS = ("p50_ms", "p95_ms", "p99_ms", "queries")
+INGREDIENT_PREFIXES = (
+    "сол", "мук", "мол", "сах", "яйц", "лук", "кар", "мас", "пер", "сыр",
+)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def capture_queries(stack):
+    # С репликами чтения идут не через default: считаем запросы на всех
+    # подключениях, кроме недоступных.
+    contexts = []
+    for alias in connections:
+        try:
+            contexts.append(stack.enter_context(
+                CaptureQueriesContext(connections[alias])
+            ))
+        except OperationalError:
+            continue
+    return contexts
+
+
+def most_active_user():
+    # Самый активный пользователь дает самые тяжелые ответы.
+    user = User.objects.annotate(
+        follows=Count("follower", distinct=True),
+        cart_size=Count("cart", distinct=True),
+    ).order_by("-follows", "-cart_size").first()
+    if user is None:
+        raise CommandError(
+            "Нет пользователей, сначала запустите seed_benchmark"
+        )
+    return user
+
+
+class Command(BaseCommand):
+    help = "Замеряет задержку и число SQL-запросов основных эндпоинтов API"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests", type=int, default=200,
+            help="Число запросов к каждому эндпоинту",
+        )
+        parser.add_argument("--warmup", type=int, default=10)
+        parser.add_argument(
+            "--user",
+            help="email пользователя, от имени которого идут запросы",
+        )
+        parser.add_argument("--output", help="Сохранить результаты в JSON")
+        parser.add_argument(
+            "--compare", help="JSON с результатами для сравнения"
+        )
+        parser.add_argument(
+            "--threshold", type=float, default=10,
+            help="Допустимое ухудшение метрик в процентах",
+        )
+
+    def handle(self, *args, **options):
+        token, _ = Token.objects.get_or_create(
+            user=self.get_user(options["user"])
+        )
+        client = Client(HTTP_AUTHORIZATION=f"Token {token.key}")
+        with override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]
+        ):
+            results = {
+                name: self.run(client, urls, options)
+                for name, urls in self.get_endpoints().items()
+            }
+        report = {
+            "revision": git_revision(),
+            "created": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "data": {
+                "users": User.objects.count(),
+                "recipes": Recipe.objects.count(),
+                "ingredients": Ingredient.objects.count(),
+            },
+            "requests": options["requests"],
+            "results": results,
+        }
+        self.print_results(results)
+        if options["output"]:
+            with open(options["output"], "w", encoding="UTF-8") as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        if options["compare"]:
+            self.compare(results, options["compare"], options["threshold"])
+
+    def get_user(self, email):
+        if email:
+            user = User.objects.filter(email=email).first()
+            if user is None:
+                raise CommandError(f"Пользователь {email} не найден")
+            return user
+        return most_active_user()
+
+    def get_endpoints(self):
+        # Самые популярные рецепты: одинаковый набор от запуска к запуску.
+        recipe_ids = list(Recipe.objects.order_by(
+            "-favorites_count", "id"
+        ).values_list("id", flat=True)[:100])
+        if not recipe_ids:
+            raise CommandError(
+                "Нет рецептов, сначала запустите seed_benchmark"
+            )
+        return {
+            "recipes": ["/api/recipes/?limit=6"],
+            "recipes_filtered": [
+                "/api/recipes/?limit=6&tags=breakfast&tags=lunch"
+                "&is_favorited=1"
+            ],
+            "recipe_detail": [
+                f"/api/recipes/{recipe_id}/" for recipe_id in recipe_ids
+            ],
+            "subscriptions": [
+                "/api/users/subscriptions/?limit=6&recipes_limit=3"
+            ],
+            "ingredients": [
+                f"/api/ingredients/?name={prefix}"
+                for prefix in INGREDIENT_PREFIXES
+            ],
+            "download_shopping_cart": [
+                "/api/recipes/download_shopping_cart/"
+            ],
+        }
+
+    def run(self, client, urls, options):
+        urls = cycle(urls)
+        for _ in range(options["warmup"]):
+            self.request(client, next(urls))
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for _ in range(options["requests"]):
+            with ExitStack() as stack:
+                contexts = capture_queries(stack)
+                request_started = time.perf_counter()
+                status = self.request(client, next(urls))
+                latencies.append(time.perf_counter() - request_started)
+            queries.append(sum(len(context) for context in contexts))
+            errors += status >= 400
+        elapsed = time.perf_counter() - started
+        p50, p95, p99 = np.percentile(latencies, (50, 95, 99)) * 1000
+        return {
+            "p50_ms": round(p50, 2),
+            "p95_ms": round(p95, 2),
+            "p99_ms": round(p99, 2),
+            "queries": round(float(np.mean(queries)), 2),
+            "max_queries": max(queries),
+            "rps": round(options["requests"] / elapsed, 1),
+            "errors": errors,
+        }
+
+    def request(self, client, url):
+        response = client.get(url)
+        if response.streaming:
+            b"".join(response.streaming_content)
+        return response.status_code
+
+    def print_results(self, results):
+        self.stdout.write(
+            f"{'эндпоинт':<24}{'p50':>9}{'p95':>9}{'p99':>9}"
+            f"{'SQL':>7}{'rps':>8}{'ошибки':>8}"
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<24}{result['p50_ms']:>9}{result['p95_ms']:>9}"
+                f"{result['p99_ms']:>9}{result['queries']:>7}"
+                f"{result['rps']:>8}{result['errors']:>8}"
+            )
+
+    def compare(self, results, path, threshold):
+        with open(path, encoding="UTF-8") as file:
+            baseline = json.load(file)
+        self.stdout.write(
+            f"Сравнение с {baseline.get('revision') or path}:"
+        )
+        regressions = []
+        for name, result in results.items():
+            previous = baseline["results"].get(name)
+            if previous is None:
+                continue
+            changes = []
+            for metric in COMPARED_METRICS:
+                before, after = previous[metric], result[metric]
+                change = (after - before) / before * 100 if before else 0
+                changes.append(
+                    f"{metric} {before} -> {after} ({change:+.0f}%)"
+                )
+                if change > threshold:
+                    regressions.append(f"{name} {metric} {change:+.0f}%")
+            self.stdout.write(f"  {name}: " + ", ".join(changes))
+        if regressions:
+            raise CommandError("Ухудшения: " + "; ".join(regressions))
+        self.stdout.write(self.style.SUCCESS("Ухудшений нет"))
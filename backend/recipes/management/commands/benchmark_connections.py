@@ -0,0 +1,217 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from itertools import cycle
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from rest_framework.authtoken.models import Token
+
+from foodgram_backend.db.pool import close_pools, get_stats
+from recipes.models import Recipe
+from .benchmark_api import git_revision, most_active_user
+
+MODES = {
+    "direct": {"CONN_MAX_AGE": 0, "POOL_SIZE": 0},
+    "persistent": {"CONN_MAX_AGE": 600, "POOL_SIZE": 0},
+    "pool": {"CONN_MAX_AGE": 0, "POOL_SIZE": None},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает задержку запросов без переиспользования соединений "
+        "с базой, с постоянными соединениями и с пулом"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threads", type=int, default=16,
+            help="Число потоков, одновременно выполняющих запросы",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=100,
+            help="Число запросов в каждом потоке",
+        )
+        parser.add_argument(
+            "--pool-size", type=int,
+            help="Размер пула, по умолчанию половина числа потоков",
+        )
+        parser.add_argument(
+            "--connect-delay", type=float, default=0,
+            help=(
+                "Дополнительная задержка установки соединения в мс: "
+                "имитация сети и аутентификации удаленного Postgres"
+            ),
+        )
+        parser.add_argument(
+            "--modes", nargs="+", choices=MODES, default=list(MODES)
+        )
+        parser.add_argument("--output", help="Сохранить результаты в JSON")
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if not hasattr(connection, "connection_pool"):
+            raise CommandError(
+                "Нужен бэкенд foodgram_backend.db.postgresql "
+                "или foodgram_backend.db.sqlite3"
+            )
+        token, _ = Token.objects.get_or_create(user=most_active_user())
+        recipe_ids = list(Recipe.objects.order_by(
+            "-favorites_count", "id"
+        ).values_list("id", flat=True)[:20])
+        paths = [
+            "/api/recipes/?limit=6",
+            "/api/users/subscriptions/?limit=6&recipes_limit=3",
+        ] + [f"/api/recipes/{recipe_id}/" for recipe_id in recipe_ids]
+        pool_size = options["pool_size"] or max(options["threads"] // 2, 1)
+        results = {}
+        with self.connect_delay(options["connect_delay"]), override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]
+        ):
+            for mode in options["modes"]:
+                with self.mode(connection.settings_dict, mode, pool_size):
+                    results[mode] = self.load(
+                        paths, token.key, options["threads"],
+                        options["requests"],
+                    )
+        self.print_results(results)
+        if options["output"]:
+            with open(options["output"], "w", encoding="UTF-8") as file:
+                json.dump(
+                    {
+                        "revision": git_revision(),
+                        "database": connection.vendor,
+                        "threads": options["threads"],
+                        "pool_size": pool_size,
+                        "connect_delay_ms": options["connect_delay"],
+                        "results": results,
+                    },
+                    file, ensure_ascii=False, indent=2,
+                )
+
+    @contextmanager
+    def connect_delay(self, delay):
+        def sleep(sender, connection, **kwargs):
+            if connection.alias == DEFAULT_DB_ALIAS:
+                time.sleep(delay / 1000)
+
+        if delay:
+            connection_created.connect(sleep)
+        try:
+            yield
+        finally:
+            connection_created.disconnect(sleep)
+
+    @contextmanager
+    def mode(self, settings_dict, mode, pool_size):
+        # Настройки общие для соединений всех потоков, поэтому их можно
+        # поменять на время замера.
+        original = {
+            "CONN_MAX_AGE": settings_dict["CONN_MAX_AGE"],
+            "POOL": settings_dict.get("POOL"),
+        }
+        values = MODES[mode]
+        connections.close_all()
+        close_pools()
+        settings_dict["CONN_MAX_AGE"] = values["CONN_MAX_AGE"]
+        settings_dict["POOL"] = {
+            **(original["POOL"] or {}),
+            "MAX_SIZE": (
+                pool_size if values["POOL_SIZE"] is None
+                else values["POOL_SIZE"]
+            ),
+        }
+        try:
+            yield
+        finally:
+            connections.close_all()
+            close_pools()
+            settings_dict.update(original)
+
+    def load(self, paths, token, threads, requests):
+        stats = get_stats(DEFAULT_DB_ALIAS)
+        before = stats.snapshot()
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+
+        def client(offset):
+            http = Client(HTTP_AUTHORIZATION=f"Token {token}")
+            urls = cycle(paths[offset % len(paths):] + paths)
+            local_latencies, local_errors = [], 0
+            try:
+                for _ in range(requests):
+                    started = time.perf_counter()
+                    # Тестовый клиент не закрывает соединения сам: повторяем
+                    # то, что делает WSGI-обработчик в начале и конце запроса.
+                    close_old_connections()
+                    try:
+                        local_errors += http.get(next(urls)).status_code >= 400
+                    except Exception:
+                        local_errors += 1
+                    close_old_connections()
+                    local_latencies.append(time.perf_counter() - started)
+            finally:
+                connections.close_all()
+            with lock:
+                latencies.extend(local_latencies)
+                errors[0] += local_errors
+
+        started = time.perf_counter()
+        workers = [
+            threading.Thread(target=client, args=(number,))
+            for number in range(threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        after = stats.snapshot()
+        total = len(latencies)
+        p50, p95, p99 = np.percentile(latencies, (50, 95, 99)) * 1000
+        return {
+            "requests": total,
+            "rps": round(total / elapsed, 1),
+            "p50_ms": round(p50, 2),
+            "p95_ms": round(p95, 2),
+            "p99_ms": round(p99, 2),
+            "connections": after["opened"] - before["opened"],
+            "connect_ms_per_request": round(
+                (after["connect_seconds"] - before["connect_seconds"])
+                * 1000 / total, 3
+            ),
+            "pool_waits": after["waits"] - before["waits"],
+            "pool_wait_ms_per_request": round(
+                (after["wait_seconds"] - before["wait_seconds"])
+                * 1000 / total, 3
+            ),
+            "pool_timeouts": after["timeouts"] - before["timeouts"],
+            "errors": errors[0],
+        }
+
+    def print_results(self, results):
+        self.stdout.write(
+            f"{'режим':<12}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}"
+            f"{'соедин.':>9}{'connect':>9}{'ожид.':>7}{'wait':>8}"
+            f"{'ошибки':>8}"
+        )
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:<12}{result['rps']:>8}{result['p50_ms']:>9}"
+                f"{result['p95_ms']:>9}{result['p99_ms']:>9}"
+                f"{result['connections']:>9}"
+                f"{result['connect_ms_per_request']:>9}"
+                f"{result['pool_waits']:>7}"
+                f"{result['pool_wait_ms_per_request']:>8}"
+                f"{result['errors']:>8}"
+            )
+        self.stdout.write(
+            "connect и wait - среднее время установки соединения "
+            "и ожидания пула на один запрос, мс"
+        )
@@ -0,0 +1,187 @@
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from itertools import cycle
+from urllib.parse import quote
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Recipe
+from .benchmark_api import git_revision, most_active_user
+
+SERVERS = {
+    "wsgi": (
+        ["--worker-class", "sync"], "foodgram_backend.wsgi", {}
+    ),
+    "asgi": (
+        ["--worker-class", "uvicorn.workers.UvicornWorker"],
+        "foodgram_backend.asgi",
+        {"ASYNC_READ_VIEWS": "True"},
+    ),
+}
+STARTUP_TIMEOUT = 30
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает sync gunicorn и ASGI (uvicorn) воркеры "
+        "под конкурентной нагрузкой"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument(
+            "--concurrency", type=int, nargs="+", default=[16, 64, 256],
+            help="Число одновременных клиентов, можно несколько значений",
+        )
+        parser.add_argument(
+            "--duration", type=float, default=10,
+            help="Длительность каждого замера в секундах",
+        )
+        parser.add_argument("--port", type=int, default=8100)
+        parser.add_argument(
+            "--servers", nargs="+", choices=SERVERS, default=list(SERVERS)
+        )
+        parser.add_argument("--output", help="Сохранить результаты в JSON")
+
+    def handle(self, *args, **options):
+        token, _ = Token.objects.get_or_create(user=most_active_user())
+        recipe_ids = list(Recipe.objects.order_by(
+            "-favorites_count", "id"
+        ).values_list("id", flat=True)[:100])
+        paths = [
+            "/api/recipes/?limit=6",
+            "/api/users/subscriptions/?limit=6&recipes_limit=3",
+            "/api/tags/",
+            "/api/ingredients/?name=" + quote("сол"),
+        ] + [f"/api/recipes/{recipe_id}/" for recipe_id in recipe_ids[:10]]
+        headers = {"Authorization": f"Token {token.key}"}
+        results = {}
+        for name in options["servers"]:
+            with self.server(name, options) as port:
+                results[name] = {
+                    concurrency: self.load(
+                        port, paths, headers, concurrency,
+                        options["duration"],
+                    )
+                    for concurrency in options["concurrency"]
+                }
+        self.print_results(results)
+        if options["output"]:
+            with open(options["output"], "w", encoding="UTF-8") as file:
+                json.dump(
+                    {
+                        "revision": git_revision(),
+                        "workers": options["workers"],
+                        "duration": options["duration"],
+                        "results": results,
+                    },
+                    file, ensure_ascii=False, indent=2,
+                )
+
+    @contextmanager
+    def server(self, name, options):
+        worker_args, application, env = SERVERS[name]
+        port = options["port"]
+        self.stdout.write(f"Запуск {name} на порту {port}...")
+        process = subprocess.Popen(
+            [
+                sys.executable, "-m", "gunicorn", application,
+                "--bind", f"127.0.0.1:{port}",
+                "--workers", str(options["workers"]),
+                "--log-level", "warning",
+                *worker_args,
+            ],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, **env},
+        )
+        try:
+            self.wait_until_ready(port, process)
+            yield port
+        finally:
+            process.terminate()
+            process.wait()
+
+    def wait_until_ready(self, port, process):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError("Сервер завершился при запуске")
+            try:
+                connection = http.client.HTTPConnection(
+                    "127.0.0.1", port, timeout=1
+                )
+                connection.request("GET", "/api/tags/")
+                connection.getresponse().read()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError("Сервер не запустился")
+
+    def load(self, port, paths, headers, concurrency, duration):
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+
+        def client(offset):
+            connection = http.client.HTTPConnection(
+                "127.0.0.1", port, timeout=30
+            )
+            urls = cycle(paths[offset % len(paths):] + paths)
+            local_latencies, local_errors = [], 0
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    connection.request("GET", next(urls), headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    local_errors += response.status >= 400
+                except (OSError, http.client.HTTPException):
+                    local_errors += 1
+                    connection.close()
+                local_latencies.append(time.perf_counter() - started)
+            connection.close()
+            with lock:
+                latencies.extend(local_latencies)
+                errors[0] += local_errors
+
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=client, args=(number,))
+            for number in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        p50, p95, p99 = np.percentile(latencies, (50, 95, 99)) * 1000
+        return {
+            "requests": len(latencies),
+            "rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(p50, 2),
+            "p95_ms": round(p95, 2),
+            "p99_ms": round(p99, 2),
+            "errors": errors[0],
+        }
+
+    def print_results(self, results):
+        self.stdout.write(
+            f"{'сервер':<8}{'клиентов':>10}{'rps':>10}{'p50':>10}"
+            f"{'p95':>10}{'p99':>10}{'ошибки':>8}"
+        )
+        for name, by_concurrency in results.items():
+            for concurrency, result in by_concurrency.items():
+                self.stdout.write(
+                    f"{name:<8}{concurrency:>10}{result['rps']:>10}"
+                    f"{result['p50_ms']:>10}{result['p95_ms']:>10}"
+                    f"{result['p99_ms']:>10}{result['errors']:>8}"
+                )
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.recommendations import compute_recommendations, compute_trending
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает популярные и рекомендованные рецепты"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--trending-only",
+            action="store_true",
+            help="Пересчитать только популярные рецепты",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        compute_trending()
+        if not options["trending_only"]:
+            compute_recommendations()
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово за {time.perf_counter() - started:.1f} с"
+        ))
@@ -1,28 +1,135 @@
 import csv
+import json
 import os
+import time
+from itertools import islice
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from recipes.cache import bump_version
 from recipes.models import Ingredient
 
-
-CSV_FILE_PATH = os.path.joinCSV_FILE_PATH = os.path.join(
+DEFAULT_FILE_PATH = os.path.join(
     settings.BASE_DIR, 'data', 'ingredients.csv'
 )
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0].strip(), row[1].strip()
+
+
+def read_json(file):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        chunk = file.read(READ_CHUNK_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise CommandError('Ожидается JSON-массив ингредиентов')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise CommandError('Некорректный JSON')
+                break
+            yield item['name'].strip(), item['measurement_unit'].strip()
+        if not chunk:
+            return
+
+
+READERS = {'.csv': read_csv, '.json': read_json}
 
 
 class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_FILE_PATH)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только прочитать файл и посчитать новые ингредиенты',
+        )
+        parser.add_argument(
+            '--update',
+            action='store_true',
+            help='Обновить единицы измерения у существующих ингредиентов',
+        )
+
     def handle(self, *args, **options):
-        with open(
-            CSV_FILE_PATH, 'r', encoding='UTF-8'
-        ) as file:
-            reader = csv.reader(file)
-            for row in reader:
-                Ingredient.objects.get_or_create(
-                    name=row[0],
-                    measurement_unit=row[1]
+        path = options['path']
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json')
+        started = time.perf_counter()
+        total = created = updated = 0
+        with open(path, 'r', encoding='UTF-8') as file:
+            rows = reader(file)
+            while True:
+                batch = dict.fromkeys(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                total += len(batch)
+                batch_created, batch_updated = self.import_batch(
+                    list(batch), options['update'], options['dry_run']
                 )
-        self.stdout.write(
-            self.style.SUCCESS('Успешно')
-        )
+                created += batch_created
+                updated += batch_updated
+        if not options['dry_run']:
+            bump_version('ingredients')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк: {total}, новых: {created}, обновлено: {updated}, '
+            f'{total / elapsed if elapsed else total:.0f} строк/с'
+            + (' (пробный запуск)' if options['dry_run'] else '')
+        ))
+
+    def import_batch(self, batch, update, dry_run):
+        existing = {}
+        for pk, name, measurement_unit in Ingredient.objects.filter(
+            name__in={name for name, _ in batch}
+        ).values_list('id', 'name', 'measurement_unit'):
+            existing.setdefault(name, {})[measurement_unit] = pk
+        new, changed = [], {}
+        for name, measurement_unit in batch:
+            units = existing.get(name, {})
+            if measurement_unit in units:
+                continue
+            if update and len(units) == 1:
+                changed[next(iter(units.values()))] = measurement_unit
+                continue
+            new.append(Ingredient(
+                name=name, measurement_unit=measurement_unit
+            ))
+        if dry_run:
+            return len(new), len(changed)
+        with transaction.atomic():
+            Ingredient.objects.bulk_update(
+                [
+                    Ingredient(id=pk, measurement_unit=measurement_unit)
+                    for pk, measurement_unit in changed.items()
+                ],
+                ['measurement_unit'],
+            )
+            Ingredient.objects.bulk_create(new, ignore_conflicts=True)
+        return len(new), len(changed)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Создает уменьшенные копии изображений рецептов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Обработать все рецепты, а не только без уменьшенных копий",
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image="")
+        if not options["all"]:
+            recipes = recipes.filter(image_thumb="")
+        recipe_ids = list(recipes.values_list("id", flat=True))
+        for recipe_id in recipe_ids:
+            process_recipe_image(recipe_id)
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано рецептов: {len(recipe_ids)}"
+        ))
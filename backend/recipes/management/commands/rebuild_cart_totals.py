@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import ShoppingCartTotal
+from recipes.services import calculate_cart_totals, rebuild_cart_totals
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает итоги списков покупок по содержимому корзин"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только сравнить сохраненные итоги с расчетными",
+        )
+
+    def handle(self, *args, **options):
+        if not options["check"]:
+            rebuild_cart_totals()
+            self.stdout.write(self.style.SUCCESS("Итоги пересчитаны"))
+            return
+        expected = {
+            (user_id, ingredient_id): total_amount
+            for user_id, amounts in calculate_cart_totals().items()
+            for ingredient_id, total_amount in amounts.items()
+        }
+        stored = {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount in (
+                ShoppingCartTotal.objects.values_list(
+                    "user_id", "ingredient_id", "total_amount"
+                ).iterator()
+            )
+        }
+        drift = {
+            key for key in expected.keys() | stored.keys()
+            if expected.get(key) != stored.get(key)
+        }
+        if drift:
+            self.stdout.write(self.style.WARNING(
+                f"Расхождений: {len(drift)}, "
+                f"пользователей: {len({user_id for user_id, _ in drift})}"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS("Расхождений нет"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recipes.services import recount_counters
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счетчики избранного, корзин, рецептов и подписчиков"
+
+    def handle(self, *args, **options):
+        recount_counters()
+        self.stdout.write(self.style.SUCCESS("Счетчики пересчитаны"))
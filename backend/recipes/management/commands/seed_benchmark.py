@@ -0,0 +1,294 @@
+import csv
+import io
+import os
+import time
+from datetime import timedelta
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image
+
+from recipes.cache import bump_version
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag, TagRecipe)
+from recipes.search import update_search_vectors
+from recipes.services import rebuild_cart_totals, recount_counters
+from users.models import Follow
+
+User = get_user_model()
+
+DEFAULT_INGREDIENTS_PATH = os.path.join(
+    settings.BASE_DIR, "data", "ingredients.json"
+)
+IMAGE_NAME = "recipes/benchmark.png"
+PASSWORD = "benchmark"
+TAGS = (
+    ("Завтрак", "#E26C2D", "breakfast"),
+    ("Обед", "#49B64E", "lunch"),
+    ("Ужин", "#8775D2", "dinner"),
+    ("Десерт", "#F2C94C", "dessert"),
+    ("Постное", "#2D9CDB", "lenten"),
+)
+
+
+def popularity(rng, size, exponent=1.0):
+    # Распределение Ципфа: немногие объекты собирают большую часть связей.
+    weights = 1 / (rng.permutation(size) + 1) ** exponent
+    return weights / weights.sum()
+
+
+def sample_pairs(rng, left_size, right_size, mean, weights=None, minimum=0):
+    counts = np.maximum(rng.poisson(mean, left_size), minimum)
+    left = np.repeat(np.arange(left_size, dtype=np.int64), counts)
+    right = rng.choice(right_size, len(left), p=weights)
+    pairs = np.unique(left * right_size + right)
+    return pairs // right_size, pairs % right_size
+
+
+def insert_rows(model, fields, rows, batch_size):
+    rows = iter(rows)
+    if connection.vendor == "postgresql":
+        columns = ", ".join(
+            connection.ops.quote_name(model._meta.get_field(field).column)
+            for field in fields
+        )
+        sql = (
+            f"COPY {connection.ops.quote_name(model._meta.db_table)} "
+            f"({columns}) FROM STDIN WITH (FORMAT csv)"
+        )
+        with connection.cursor() as cursor:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(batch)
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+        return
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        model.objects.bulk_create(
+            model(**dict(zip(fields, row))) for row in batch
+        )
+
+
+class Command(BaseCommand):
+    help = "Заполняет базу синтетическими данными для нагрузочных тестов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--recipes", type=int, default=10000)
+        parser.add_argument(
+            "--ingredients-per-recipe", type=float, default=8,
+            help="Среднее число ингредиентов в рецепте",
+        )
+        parser.add_argument(
+            "--follows", type=float, default=10,
+            help="Среднее число подписок у пользователя",
+        )
+        parser.add_argument(
+            "--favorites", type=float, default=30,
+            help="Среднее число рецептов в избранном у пользователя",
+        )
+        parser.add_argument(
+            "--cart", type=float, default=5,
+            help="Среднее число рецептов в списке покупок у пользователя",
+        )
+        parser.add_argument(
+            "--days", type=int, default=30,
+            help="За сколько дней распределить добавления в избранное",
+        )
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--ingredients-file", default=DEFAULT_INGREDIENTS_PATH
+        )
+
+    def handle(self, *args, **options):
+        self.rng = np.random.default_rng(options["seed"])
+        self.batch_size = options["batch_size"]
+        started = time.perf_counter()
+        if not Ingredient.objects.exists():
+            call_command(
+                "create_ingredients", options["ingredients_file"],
+                stdout=self.stdout,
+            )
+        ingredients = list(
+            Ingredient.objects.order_by("id").values_list("id", "name")
+        )
+        tag_ids = self.create_tags()
+        with transaction.atomic():
+            user_ids = self.create_users(options["users"])
+            recipe_ids = self.create_recipes(
+                options["recipes"], user_ids, ingredients, tag_ids,
+                options["ingredients_per_recipe"],
+            )
+            self.create_interactions(user_ids, recipe_ids, options)
+            self.stdout.write("Пересчет счетчиков и списков покупок...")
+            recount_counters()
+            rebuild_cart_totals()
+            bump_version("recipe_ingredients")
+        update_search_vectors()
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово за {time.perf_counter() - started:.1f} с"
+        ))
+
+    def report(self, name, count):
+        self.stdout.write(f"{name}: {count}")
+
+    def create_tags(self):
+        for name, color, slug in TAGS:
+            Tag.objects.get_or_create(
+                slug=slug, defaults={"name": name, "color": color}
+            )
+        return np.array(
+            Tag.objects.order_by("id").values_list("id", flat=True)
+        )
+
+    def create_users(self, count):
+        start = (User.objects.order_by("-id").values_list(
+            "id", flat=True
+        ).first() or 0) + 1
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            (
+                User(
+                    username=f"bench{number}",
+                    email=f"bench{number}@example.com",
+                    first_name="Пользователь",
+                    last_name=str(number),
+                    password=password,
+                )
+                for number in range(start, start + count)
+            ),
+            batch_size=self.batch_size,
+        )
+        user_ids = np.fromiter(
+            User.objects.filter(id__gte=start).order_by("id").values_list(
+                "id", flat=True
+            ),
+            dtype=np.int64,
+        )
+        self.report("Пользователи", len(user_ids))
+        return user_ids
+
+    def create_recipes(self, count, user_ids, ingredients, tag_ids,
+                       ingredients_per_recipe):
+        if not default_storage.exists(IMAGE_NAME):
+            buffer = io.BytesIO()
+            Image.new("RGB", (600, 400), (236, 216, 180)).save(buffer, "PNG")
+            default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+        rng = self.rng
+        recipe_rows, ingredient_index = sample_pairs(
+            rng, count, len(ingredients), ingredients_per_recipe - 1,
+            popularity(rng, len(ingredients)), minimum=1,
+        )
+        bounds = np.searchsorted(recipe_rows, np.arange(count + 1))
+        authors = rng.choice(
+            user_ids, count, p=popularity(rng, len(user_ids), 1.2)
+        )
+        cooking_times = rng.integers(5, 180, count)
+        start = (Recipe.objects.order_by("-id").values_list(
+            "id", flat=True
+        ).first() or 0) + 1
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author_id=int(authors[number]),
+                    name=f"Рецепт {start + number}",
+                    text="Смешайте: " + ", ".join(
+                        ingredients[index][1] for index in ingredient_index[
+                            bounds[number]:bounds[number + 1]
+                        ]
+                    ) + ".",
+                    image=IMAGE_NAME,
+                    cooking_time=int(cooking_times[number]),
+                )
+                for number in range(count)
+            ),
+            batch_size=self.batch_size,
+        )
+        recipe_ids = np.fromiter(
+            Recipe.objects.filter(id__gte=start).order_by("id").values_list(
+                "id", flat=True
+            ),
+            dtype=np.int64,
+        )
+        self.report("Рецепты", len(recipe_ids))
+        amounts = rng.integers(1, 500, len(recipe_rows))
+        insert_rows(
+            IngredientRecipe,
+            ("recipe_id", "ingredient_id", "amount"),
+            zip(
+                recipe_ids[recipe_rows].tolist(),
+                (ingredients[index][0] for index in ingredient_index),
+                amounts.tolist(),
+            ),
+            self.batch_size,
+        )
+        self.report("Ингредиенты рецептов", len(recipe_rows))
+        recipe_rows, tag_index = sample_pairs(
+            rng, count, len(tag_ids), 0.5, minimum=1
+        )
+        insert_rows(
+            TagRecipe,
+            ("recipe_id", "tag_id"),
+            zip(
+                recipe_ids[recipe_rows].tolist(),
+                tag_ids[tag_index].tolist(),
+            ),
+            self.batch_size,
+        )
+        self.report("Теги рецептов", len(recipe_rows))
+        return recipe_ids
+
+    def create_interactions(self, user_ids, recipe_ids, options):
+        rng = self.rng
+        now = timezone.now()
+        users, authors = sample_pairs(
+            rng, len(user_ids), len(user_ids), options["follows"],
+            popularity(rng, len(user_ids), 1.2),
+        )
+        own = users == authors
+        insert_rows(
+            Follow,
+            ("user_id", "author_id"),
+            zip(
+                user_ids[users[~own]].tolist(),
+                user_ids[authors[~own]].tolist(),
+            ),
+            self.batch_size,
+        )
+        self.report("Подписки", int((~own).sum()))
+        weights = popularity(rng, len(recipe_ids))
+        for model, name, mean in (
+            (Favorite, "Избранное", options["favorites"]),
+            (ShoppingCart, "Списки покупок", options["cart"]),
+        ):
+            users, recipes = sample_pairs(
+                rng, len(user_ids), len(recipe_ids), mean, weights
+            )
+            ages = rng.uniform(0, options["days"] * 86400, len(users))
+            insert_rows(
+                model,
+                ("user_id", "recipe_id", "created"),
+                zip(
+                    user_ids[users].tolist(),
+                    recipe_ids[recipes].tolist(),
+                    (now - timedelta(seconds=age) for age in ages.tolist()),
+                ),
+                self.batch_size,
+            )
+            self.report(name, len(users))
@@ -0,0 +1,43 @@
+import numpy as np
+from django.conf import settings
+from scipy import sparse
+
+from .indexes import SnapshotIndex
+from .models import IngredientRecipe
+
+
+class IngredientMatchIndex(SnapshotIndex):
+    namespace = "recipe_ingredients"
+
+    def build(self):
+        pairs = np.array(
+            list(IngredientRecipe.objects.values_list(
+                "recipe_id", "ingredient_id"
+            ).iterator()),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        recipe_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+        matrix = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.int32), (rows, pairs[:, 1])),
+            shape=(len(recipe_ids), int(pairs[:, 1].max(initial=0)) + 1),
+        )
+        matrix.data[:] = 1
+        return recipe_ids, matrix, np.asarray(matrix.sum(axis=1)).ravel()
+
+    def match(self, ingredient_ids, max_missing):
+        recipe_ids, matrix, totals = self.snapshot()
+        available = np.zeros(matrix.shape[1], dtype=np.int32)
+        ingredient_ids = [
+            pk for pk in ingredient_ids if 0 <= pk < len(available)
+        ]
+        available[ingredient_ids] = 1
+        covered = matrix @ available
+        missing = totals - covered
+        found = np.flatnonzero((missing <= max_missing) & (covered > 0))
+        order = np.lexsort((
+            -recipe_ids[found], -covered[found], missing[found]
+        ))
+        return recipe_ids[found[order]][:settings.MATCH_LIMIT].tolist()
+
+
+match_index = IngredientMatchIndex()
@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.utils import timezone
 
 User = get_user_model()
 
@@ -25,11 +27,55 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = "Ингредиент"
         verbose_name_plural = "Ингредиенты"
+        constraints = (
+            models.UniqueConstraint(
+                fields=("name", "measurement_unit"),
+                name="unique_ingredient",
+            ),
+        )
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_user_flags(self, user):
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(
+                Favorite.objects.filter(
+                    user=user, recipe=models.OuterRef("pk")
+                )
+            ),
+            is_in_shopping_cart=models.Exists(
+                ShoppingCart.objects.filter(
+                    user=user, recipe=models.OuterRef("pk")
+                )
+            ),
+        )
+
+    def in_order(self, ids):
+        if not ids:
+            return self.none()
+        return self.filter(id__in=ids).order_by(
+            models.Case(
+                *(
+                    models.When(id=pk, then=models.Value(position))
+                    for position, pk in enumerate(ids)
+                ),
+                output_field=models.IntegerField(),
+            )
+        )
+
+
 class Recipe(models.Model):
     tags = models.ManyToManyField(Tag, through="TagRecipe")
     author = models.ForeignKey(
@@ -42,6 +88,8 @@ class Recipe(models.Model):
     )
     name = models.CharField(max_length=150)
     image = models.ImageField()
+    image_thumb = models.ImageField(blank=True, editable=False)
+    image_medium = models.ImageField(blank=True, editable=False)
     text = models.TextField()
     cooking_time = models.PositiveIntegerField(
         validators=[MinValueValidator(1)],
@@ -49,6 +97,15 @@ class Recipe(models.Model):
             'min_value': 'Значение должно быть больше 0.',
         }
     )
+    search_vector = SearchVectorField(null=True, editable=False)
+    favorites_count = models.PositiveIntegerField(
+        "В избранном", default=0, editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        "В списках покупок", default=0, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ("-id",)
@@ -94,12 +151,13 @@ class IngredientRecipe(models.Model):
     )
     amount = models.PositiveIntegerField()
 
-    # constraints = (
-    #     models.UniqueConstraint(
-    #         fields=["ingredient", "recipe"],
-    #         name="recipe_ingredient_unique"
-    #     ),
-    # )
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=["ingredient", "recipe"],
+                name="recipe_ingredient_unique"
+            ),
+        )
 
 
 class Favorite(models.Model):
@@ -115,12 +173,17 @@ class Favorite(models.Model):
         related_name="favorite",
         on_delete=models.CASCADE,
     )
-    constraints = (
-        models.UniqueConstraint(
-            fields=["user", "recipe"], name="favorite_unique"
-        ),
+    created = models.DateTimeField(
+        "Добавлено", default=timezone.now, db_index=True
     )
 
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=["user", "recipe"], name="favorite_unique"
+            ),
+        )
+
 
 class ShoppingCart(models.Model):
     user = models.ForeignKey(
@@ -135,8 +198,105 @@ class ShoppingCart(models.Model):
         related_name="cart",
         on_delete=models.CASCADE,
     )
-    constraints = (
-        models.UniqueConstraint(
-            fields=["user", "recipe"], name="cart_unique"
-        ),
+    created = models.DateTimeField(
+        "Добавлено", default=timezone.now, db_index=True
+    )
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=["user", "recipe"], name="cart_unique"
+            ),
+        )
+
+
+class ShoppingCartTotal(models.Model):
+    user = models.ForeignKey(
+        User,
+        verbose_name="Пользователь",
+        related_name="cart_totals",
+        on_delete=models.CASCADE,
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name="Ингредиент",
+        related_name="cart_totals",
+        on_delete=models.CASCADE,
+    )
+    total_amount = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = "Итог списка покупок"
+        verbose_name_plural = "Итоги списков покупок"
+        constraints = (
+            models.UniqueConstraint(
+                fields=["user", "ingredient"], name="cart_total_unique"
+            ),
+        )
+
+
+class TrendingRecipe(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        verbose_name="Рецепт",
+        related_name="trending",
+        on_delete=models.CASCADE,
+    )
+    score = models.FloatField("Популярность", db_index=True)
+
+    class Meta:
+        ordering = ("-score",)
+        verbose_name = "Популярный рецепт"
+        verbose_name_plural = "Популярные рецепты"
+
+
+class UserRecommendation(models.Model):
+    user = models.ForeignKey(
+        User,
+        verbose_name="Пользователь",
+        related_name="recommendations",
+        on_delete=models.CASCADE,
     )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name="Рецепт",
+        related_name="user_recommendations",
+        on_delete=models.CASCADE,
+    )
+    score = models.FloatField("Оценка")
+
+    class Meta:
+        ordering = ("-score",)
+        verbose_name = "Рекомендация пользователю"
+        verbose_name_plural = "Рекомендации пользователям"
+        indexes = (
+            models.Index(
+                fields=("user", "-score"), name="user_recommendation_idx"
+            ),
+        )
+
+
+class SimilarRecipe(models.Model):
+    source = models.ForeignKey(
+        Recipe,
+        verbose_name="Исходный рецепт",
+        related_name="similar",
+        on_delete=models.CASCADE,
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name="Похожий рецепт",
+        related_name="similar_to",
+        on_delete=models.CASCADE,
+    )
+    score = models.FloatField("Оценка")
+
+    class Meta:
+        ordering = ("-score",)
+        verbose_name = "Похожий рецепт"
+        verbose_name_plural = "Похожие рецепты"
+        indexes = (
+            models.Index(
+                fields=("source", "-score"), name="similar_recipe_idx"
+            ),
+        )
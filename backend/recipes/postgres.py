@@ -0,0 +1,22 @@
+from django.db import connections
+
+INDEXES = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS recipes_ingredient_name_pattern "
+    "ON recipes_ingredient (UPPER(name::text) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS recipes_ingredient_upper_name_trgm "
+    "ON recipes_ingredient USING gin (UPPER(name::text) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm "
+    "ON recipes_ingredient USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector "
+    "ON recipes_recipe USING gin (search_vector)",
+)
+
+
+def create_postgres_indexes(using, **kwargs):
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        for sql in INDEXES:
+            cursor.execute(sql)
@@ -0,0 +1,223 @@
+import math
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from scipy import sparse
+
+from .models import (Favorite, IngredientRecipe, Recipe, ShoppingCart,
+                     SimilarRecipe, TagRecipe, TrendingRecipe,
+                     UserRecommendation)
+
+User = get_user_model()
+
+FAVORITE_WEIGHT = 1.0
+CART_WEIGHT = 0.5
+CHUNK_SIZE = 100_000
+
+
+def iter_chunks(queryset, fields):
+    rows = queryset.values_list(*fields).iterator(chunk_size=CHUNK_SIZE)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def positions(sorted_ids, ids):
+    index = np.searchsorted(sorted_ids, ids)
+    found = index < len(sorted_ids)
+    found[found] = sorted_ids[index[found]] == ids[found]
+    return index, found
+
+
+def compute_trending():
+    now = timezone.now()
+    since = now - timedelta(days=settings.TRENDING_WINDOW_DAYS)
+    decay = math.log(2) / (settings.TRENDING_HALF_LIFE_HOURS * 3600)
+    recipe_ids = np.fromiter(
+        Recipe.objects.order_by("id").values_list("id", flat=True),
+        dtype=np.int64,
+    )
+    scores = np.zeros(len(recipe_ids))
+    for model, weight in ((Favorite, FAVORITE_WEIGHT),
+                          (ShoppingCart, CART_WEIGHT)):
+        events = model.objects.filter(created__gte=since)
+        for chunk in iter_chunks(events, ("recipe_id", "created")):
+            index, found = positions(
+                recipe_ids, np.array([recipe_id for recipe_id, _ in chunk])
+            )
+            ages = np.array(
+                [(now - created).total_seconds() for _, created in chunk]
+            )
+            np.add.at(
+                scores, index[found], weight * np.exp(-decay * ages[found])
+            )
+    top = np.argsort(-scores)[:settings.TRENDING_SIZE]
+    top = top[scores[top] > 0]
+    with transaction.atomic():
+        TrendingRecipe.objects.all().delete()
+        TrendingRecipe.objects.bulk_create(
+            TrendingRecipe(recipe_id=int(recipe_ids[i]), score=scores[i])
+            for i in top
+        )
+
+
+def interaction_matrix(recipe_ids, user_ids):
+    rows, cols, data = [], [], []
+    for model, weight in ((Favorite, FAVORITE_WEIGHT),
+                          (ShoppingCart, CART_WEIGHT)):
+        for chunk in iter_chunks(model.objects, ("user_id", "recipe_id")):
+            pairs = np.array(chunk, dtype=np.int64)
+            user_index, user_found = positions(user_ids, pairs[:, 0])
+            recipe_index, recipe_found = positions(recipe_ids, pairs[:, 1])
+            found = user_found & recipe_found
+            rows.append(user_index[found])
+            cols.append(recipe_index[found])
+            data.append(np.full(found.sum(), weight))
+    if not rows:
+        return sparse.csr_matrix((len(user_ids), len(recipe_ids)))
+    return sparse.csr_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(len(user_ids), len(recipe_ids)),
+    )
+
+
+def feature_matrix(recipe_ids):
+    rows, cols = [], []
+    offset = 0
+    for queryset, field in ((TagRecipe.objects, "tag_id"),
+                            (IngredientRecipe.objects, "ingredient_id")):
+        pairs = np.array(
+            list(queryset.values_list("recipe_id", field).iterator()),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        index, found = positions(recipe_ids, pairs[:, 0])
+        rows.append(index[found])
+        cols.append(pairs[found, 1] + offset)
+        offset += int(pairs[:, 1].max(initial=0)) + 1
+    features = sparse.csr_matrix(
+        (np.ones(sum(map(len, rows))),
+         (np.concatenate(rows), np.concatenate(cols))),
+        shape=(len(recipe_ids), offset),
+    )
+    features.data[:] = 1
+    document_frequency = np.asarray(features.sum(axis=0)).ravel()
+    idf = np.log((1 + len(recipe_ids)) / (1 + document_frequency)) + 1
+    # Слишком частые признаки почти не различают рецепты,
+    # но делают произведение матриц плотным.
+    idf[
+        document_frequency
+        > settings.RECOMMENDATIONS_MAX_FEATURE_SHARE * len(recipe_ids)
+    ] = 0
+    return normalize_rows(features @ sparse.diags(idf))
+
+
+def normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+
+def top_k(matrix, k, exclude=None):
+    matrix = matrix.tocsr()
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        columns = matrix.indices[start:end]
+        scores = matrix.data[start:end]
+        keep = scores > 0
+        if exclude is not None:
+            keep &= ~np.isin(columns, exclude.indices[
+                exclude.indptr[row]:exclude.indptr[row + 1]
+            ])
+        columns, scores = columns[keep], scores[keep]
+        if len(scores) > k:
+            best = np.argpartition(-scores, k)[:k]
+            columns, scores = columns[best], scores[best]
+        yield row, columns, scores
+
+
+def compute_similar(recipe_ids, interactions):
+    k = settings.RECOMMENDATIONS_TOP_K
+    batch_size = settings.RECOMMENDATIONS_BATCH_SIZE
+    content_weight = settings.RECOMMENDATIONS_CONTENT_WEIGHT
+    items = normalize_rows(interactions.T.tocsr())
+    features = feature_matrix(recipe_ids)
+    rows, cols, data = [], [], []
+    for start in range(0, len(recipe_ids), batch_size):
+        block = slice(start, start + batch_size)
+        similarity = (
+            (1 - content_weight) * (items[block] @ items.T)
+            + content_weight * (features[block] @ features.T)
+        )
+        itself = sparse.eye(
+            similarity.shape[0], len(recipe_ids), k=start, format="csr"
+        )
+        similar = []
+        for row, columns, scores in top_k(similarity, k, itself):
+            source = start + row
+            rows.append(np.full(len(columns), source))
+            cols.append(columns)
+            data.append(scores)
+            similar.extend(
+                SimilarRecipe(
+                    source_id=int(recipe_ids[source]),
+                    recipe_id=int(recipe_ids[column]),
+                    score=float(score),
+                )
+                for column, score in zip(columns, scores)
+            )
+        SimilarRecipe.objects.bulk_create(similar, batch_size=5000)
+    if not rows:
+        return sparse.csr_matrix((len(recipe_ids), len(recipe_ids)))
+    return sparse.csr_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(len(recipe_ids), len(recipe_ids)),
+    )
+
+
+def compute_user_recommendations(recipe_ids, user_ids, interactions,
+                                 similar):
+    k = settings.RECOMMENDATIONS_TOP_K
+    batch_size = settings.RECOMMENDATIONS_BATCH_SIZE
+    for start in range(0, len(user_ids), batch_size):
+        block = interactions[start:start + batch_size]
+        recommendations = []
+        for row, columns, scores in top_k(block @ similar, k, block):
+            recommendations.extend(
+                UserRecommendation(
+                    user_id=int(user_ids[start + row]),
+                    recipe_id=int(recipe_ids[column]),
+                    score=float(score),
+                )
+                for column, score in zip(columns, scores)
+            )
+        UserRecommendation.objects.bulk_create(
+            recommendations, batch_size=5000
+        )
+
+
+def compute_recommendations():
+    recipe_ids = np.fromiter(
+        Recipe.objects.order_by("id").values_list("id", flat=True),
+        dtype=np.int64,
+    )
+    user_ids = np.fromiter(
+        User.objects.order_by("id").values_list("id", flat=True),
+        dtype=np.int64,
+    )
+    interactions = interaction_matrix(recipe_ids, user_ids)
+    with transaction.atomic():
+        SimilarRecipe.objects.all().delete()
+        UserRecommendation.objects.all().delete()
+        similar = compute_similar(recipe_ids, interactions)
+        compute_user_recommendations(
+            recipe_ids, user_ids, interactions, similar
+        )
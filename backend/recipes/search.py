@@ -0,0 +1,128 @@
+import bisect
+import math
+import re
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import F, OuterRef, Subquery, TextField, Value
+from django.db.models.functions import Coalesce
+
+from .cache import bump_version
+from .indexes import SnapshotIndex
+from .models import IngredientRecipe, Recipe
+
+TOKEN_RE = re.compile(r"\w+")
+NAME_WEIGHT, INGREDIENT_WEIGHT, TEXT_WEIGHT = 1.0, 0.4, 0.2
+
+
+def stem(token):
+    if not token.isalpha():
+        return token
+    return token[:max(4, len(token) - 2)]
+
+
+def tokenize(text):
+    return [stem(token) for token in TOKEN_RE.findall(text.lower())]
+
+
+def update_search_vectors(recipe_ids=None):
+    if connection.vendor == "postgresql":
+        config = settings.RECIPE_SEARCH_CONFIG
+        ingredient_names = IngredientRecipe.objects.filter(
+            recipe=OuterRef("pk")
+        ).values("recipe").annotate(
+            names=StringAgg("ingredient__name", " ")
+        ).values("names")
+        recipes = Recipe.objects.all()
+        if recipe_ids is not None:
+            recipes = recipes.filter(pk__in=recipe_ids)
+        recipes.update(
+            search_vector=(
+                SearchVector("name", weight="A", config=config)
+                + SearchVector(
+                    Coalesce(
+                        Subquery(ingredient_names),
+                        Value(""),
+                        output_field=TextField(),
+                    ),
+                    weight="B",
+                    config=config,
+                )
+                + SearchVector("text", weight="C", config=config)
+            )
+        )
+    bump_version("recipe_search")
+
+
+class RecipeSearchIndex(SnapshotIndex):
+    namespace = "recipe_search"
+
+    def build(self):
+        postings = defaultdict(lambda: defaultdict(float))
+        recipe_ids = set()
+        for recipe_id, name, text in Recipe.objects.values_list(
+            "id", "name", "text"
+        ).iterator():
+            recipe_ids.add(recipe_id)
+            for token in tokenize(name):
+                postings[token][recipe_id] += NAME_WEIGHT
+            for token in tokenize(text):
+                postings[token][recipe_id] += TEXT_WEIGHT
+        for recipe_id, name in IngredientRecipe.objects.values_list(
+            "recipe_id", "ingredient__name"
+        ).iterator():
+            for token in tokenize(name):
+                postings[token][recipe_id] += INGREDIENT_WEIGHT
+        postings = {
+            token: dict(scores) for token, scores in postings.items()
+        }
+        return sorted(postings), postings, len(recipe_ids)
+
+    def search(self, query):
+        tokens, postings, documents = self.snapshot()
+        result = None
+        for token in tokenize(query):
+            scores = defaultdict(float)
+            start = bisect.bisect_left(tokens, token)
+            for position in range(start, len(tokens)):
+                if not tokens[position].startswith(token):
+                    break
+                posting = postings[tokens[position]]
+                idf = math.log(1 + documents / len(posting))
+                for recipe_id, weight in posting.items():
+                    scores[recipe_id] += weight * idf
+            if result is None:
+                result = scores
+            else:
+                result = {
+                    recipe_id: score + scores[recipe_id]
+                    for recipe_id, score in result.items()
+                    if recipe_id in scores
+                }
+        return sorted(
+            (result or {}).items(), key=lambda item: (-item[1], -item[0])
+        )
+
+
+recipe_search_index = RecipeSearchIndex()
+
+
+def search_recipes(queryset, value):
+    if connection.vendor == "postgresql":
+        query = SearchQuery(
+            value,
+            config=settings.RECIPE_SEARCH_CONFIG,
+            search_type="websearch",
+        )
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F("search_vector"), query)
+        ).order_by("-rank", "-id")
+    recipe_ids = [
+        recipe_id for recipe_id, _ in
+        recipe_search_index.search(value)[:settings.RECIPE_SEARCH_LIMIT]
+    ]
+    return queryset.in_order(recipe_ids)
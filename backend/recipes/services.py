@@ -0,0 +1,324 @@
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import (Count, Exists, F, OuterRef, Subquery, Sum,
+                              Value)
+from django.db.models.functions import Coalesce
+
+from users.models import Follow
+from .models import (Favorite, IngredientRecipe, Recipe, ShoppingCart,
+                     ShoppingCartTotal)
+
+User = get_user_model()
+
+CREATED = "created"
+EXISTS = "exists"
+DELETED = "deleted"
+MISSING = "missing"
+NOT_FOUND = "not_found"
+SELF = "self"
+
+RECIPE_FLAGS = {
+    Favorite: ("is_favorited", "favorites_count"),
+    ShoppingCart: ("is_in_shopping_cart", "in_carts_count"),
+}
+
+
+def recipe_amounts(recipe_ids):
+    return dict(
+        IngredientRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values("ingredient_id").annotate(
+            total_amount=Sum("amount")
+        ).values_list("ingredient_id", "total_amount")
+    )
+
+
+def _apply_cart_totals(user, amounts, sign):
+    if not amounts:
+        return
+    with transaction.atomic():
+        totals = {
+            total.ingredient_id: total
+            for total in ShoppingCartTotal.objects.select_for_update().filter(
+                user=user, ingredient_id__in=amounts
+            )
+        }
+        to_create, to_update, to_delete = [], [], []
+        for ingredient_id, amount in amounts.items():
+            total = totals.get(ingredient_id)
+            if total is None:
+                if sign > 0:
+                    to_create.append(ShoppingCartTotal(
+                        user=user,
+                        ingredient_id=ingredient_id,
+                        total_amount=amount,
+                    ))
+                continue
+            total.total_amount += sign * amount
+            if total.total_amount > 0:
+                to_update.append(total)
+            else:
+                to_delete.append(total.id)
+        ShoppingCartTotal.objects.bulk_create(to_create)
+        ShoppingCartTotal.objects.bulk_update(to_update, ["total_amount"])
+        ShoppingCartTotal.objects.filter(id__in=to_delete).delete()
+
+
+def add_to_cart_totals(user, recipe_ids):
+    _apply_cart_totals(user, recipe_amounts(recipe_ids), 1)
+
+
+def remove_from_cart_totals(user, recipe_ids):
+    _apply_cart_totals(user, recipe_amounts(recipe_ids), -1)
+
+
+def calculate_cart_totals(user_ids=None):
+    # Один filter() и один проход корзина -> рецепт -> ингредиенты:
+    # второй filter() по корзинам добавил бы еще одно соединение
+    # и умножил суммы на число корзин с рецептом.
+    carts = ShoppingCart.objects.filter(
+        recipe__ingredients_recipes__isnull=False,
+        **({} if user_ids is None else {"user_id__in": user_ids}),
+    )
+    totals = defaultdict(dict)
+    for user_id, ingredient_id, total_amount in carts.values(
+        "user_id", "recipe__ingredients_recipes__ingredient_id"
+    ).annotate(
+        total_amount=Sum("recipe__ingredients_recipes__amount")
+    ).values_list(
+        "user_id", "recipe__ingredients_recipes__ingredient_id",
+        "total_amount",
+    ).order_by().iterator():
+        totals[user_id][ingredient_id] = total_amount
+    return totals
+
+
+def rebuild_cart_totals(user_ids=None):
+    stored = ShoppingCartTotal.objects.all()
+    if user_ids is not None:
+        stored = stored.filter(user_id__in=user_ids)
+    with transaction.atomic():
+        if user_ids is not None:
+            _lock_users(user_ids)
+        totals = calculate_cart_totals(user_ids)
+        stored.delete()
+        ShoppingCartTotal.objects.bulk_create(
+            (
+                ShoppingCartTotal(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    total_amount=total_amount,
+                )
+                for user_id, amounts in totals.items()
+                for ingredient_id, total_amount in amounts.items()
+            ),
+            batch_size=1000,
+        )
+
+
+def lock_cart_users(recipe_ids):
+    # Добавление в корзину блокирует пользователя, а затем рецепт.
+    # Правка и удаление рецепта блокируют владельцев корзин в том же
+    # порядке - до первой записи в строку рецепта.
+    return _lock_users(
+        ShoppingCart.objects.filter(recipe_id__in=recipe_ids).values(
+            "user_id"
+        )
+    )
+
+
+def change_recipe_cart_totals(recipe_id, old_amounts, new_amounts):
+    # Правка состава рецепта сдвигает итоги всех, у кого он в корзине,
+    # на разницу количеств, без пересчета их корзин целиком.
+    deltas = defaultdict(list)
+    for ingredient_id in old_amounts.keys() | new_amounts.keys():
+        delta = (
+            new_amounts.get(ingredient_id, 0)
+            - old_amounts.get(ingredient_id, 0)
+        )
+        if delta:
+            deltas[delta].append(ingredient_id)
+    if not deltas:
+        return
+    with transaction.atomic():
+        user_ids = lock_cart_users([recipe_id])
+        if not user_ids:
+            return
+        totals = ShoppingCartTotal.objects.filter(user_id__in=user_ids)
+        for delta, ingredient_ids in deltas.items():
+            totals.filter(ingredient_id__in=ingredient_ids).update(
+                total_amount=F("total_amount") + delta
+            )
+        added = [
+            ingredient_id
+            for delta, ingredient_ids in deltas.items() if delta > 0
+            for ingredient_id in ingredient_ids
+        ]
+        existing = set(totals.filter(ingredient_id__in=added).values_list(
+            "user_id", "ingredient_id"
+        ))
+        ShoppingCartTotal.objects.bulk_create(
+            ShoppingCartTotal(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=new_amounts[ingredient_id],
+            )
+            for user_id in user_ids
+            for ingredient_id in added
+            if (user_id, ingredient_id) not in existing
+        )
+        totals.filter(total_amount__lte=0).delete()
+
+
+def change_counter(queryset, field, delta):
+    if delta < 0:
+        queryset = queryset.filter(**{f"{field}__gte": -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def _count(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(
+                **{field: OuterRef("pk")}
+            ).values(field).annotate(total=Count("pk")).values("total")
+        ),
+        Value(0),
+    )
+
+
+def recount_counters():
+    with transaction.atomic():
+        Recipe.objects.update(
+            favorites_count=_count(Favorite, "recipe"),
+            in_carts_count=_count(ShoppingCart, "recipe"),
+        )
+        User.objects.update(
+            recipes_count=_count(Recipe, "author"),
+            followers_count=_count(Follow, "author"),
+        )
+
+
+def _lock_users(user_ids):
+    # Строки берутся по возрастанию id: две транзакции с общими
+    # пользователями не будут ждать друг друга по кругу.
+    return list(User.objects.select_for_update().filter(
+        id__in=user_ids
+    ).order_by("id").values_list("id", flat=True))
+
+
+def _lock_user(user):
+    # Операции одного пользователя выполняются по очереди,
+    # поэтому повторный клик не увеличит счетчики дважды.
+    _lock_users([user.id])
+
+
+def _statuses(ids, present, if_present, if_absent):
+    return {
+        pk: NOT_FOUND if pk not in present
+        else if_present if present[pk] else if_absent
+        for pk in ids
+    }
+
+
+def _present_recipes(model, user, recipe_ids):
+    flag, _ = RECIPE_FLAGS[model]
+    return dict(
+        Recipe.objects.filter(id__in=recipe_ids).with_user_flags(
+            user
+        ).values_list("id", flag)
+    )
+
+
+def add_recipes(model, user, recipe_ids):
+    _, counter = RECIPE_FLAGS[model]
+    with transaction.atomic():
+        _lock_user(user)
+        present = _present_recipes(model, user, recipe_ids)
+        new = [pk for pk, is_present in present.items() if not is_present]
+        model.objects.bulk_create(
+            [model(user=user, recipe_id=pk) for pk in new],
+            ignore_conflicts=True,
+        )
+        change_counter(Recipe.objects.filter(id__in=new), counter, 1)
+        if model is ShoppingCart:
+            add_to_cart_totals(user, new)
+    return _statuses(recipe_ids, present, EXISTS, CREATED)
+
+
+def remove_recipes(model, user, recipe_ids):
+    _, counter = RECIPE_FLAGS[model]
+    with transaction.atomic():
+        _lock_user(user)
+        present = _present_recipes(model, user, recipe_ids)
+        removed = [pk for pk, is_present in present.items() if is_present]
+        model.objects.filter(user=user, recipe_id__in=removed).delete()
+        change_counter(Recipe.objects.filter(id__in=removed), counter, -1)
+        if model is ShoppingCart:
+            remove_from_cart_totals(user, removed)
+    return _statuses(recipe_ids, present, DELETED, MISSING)
+
+
+def clear_cart(user):
+    with transaction.atomic():
+        _lock_user(user)
+        recipe_ids = list(
+            ShoppingCart.objects.filter(user=user).values_list(
+                "recipe_id", flat=True
+            )
+        )
+        ShoppingCart.objects.filter(user=user).delete()
+        ShoppingCartTotal.objects.filter(user=user).delete()
+        change_counter(
+            Recipe.objects.filter(id__in=recipe_ids), "in_carts_count", -1
+        )
+    return dict.fromkeys(recipe_ids, DELETED)
+
+
+def _present_authors(user, author_ids):
+    return dict(
+        User.objects.filter(id__in=author_ids).annotate(
+            present=Exists(
+                Follow.objects.filter(user=user, author=OuterRef("pk"))
+            )
+        ).values_list("id", "present")
+    )
+
+
+def _lock_follow_users(user, author_ids):
+    # Счетчики подписчиков лежат в строках авторов: встречные подписки
+    # A -> B и B -> A без общего порядка блокировок ждали бы друг друга.
+    _lock_users([user.id, *author_ids])
+
+
+def add_follows(user, author_ids):
+    with transaction.atomic():
+        _lock_follow_users(user, author_ids)
+        present = _present_authors(user, author_ids)
+        new = [
+            pk for pk, is_present in present.items()
+            if not is_present and pk != user.id
+        ]
+        Follow.objects.bulk_create(
+            [Follow(user=user, author_id=pk) for pk in new],
+            ignore_conflicts=True,
+        )
+        change_counter(User.objects.filter(id__in=new), "followers_count", 1)
+    statuses = _statuses(author_ids, present, EXISTS, CREATED)
+    if user.id in present:
+        statuses[user.id] = SELF
+    return statuses
+
+
+def remove_follows(user, author_ids):
+    with transaction.atomic():
+        _lock_follow_users(user, author_ids)
+        present = _present_authors(user, author_ids)
+        removed = [pk for pk, is_present in present.items() if is_present]
+        Follow.objects.filter(user=user, author_id__in=removed).delete()
+        change_counter(
+            User.objects.filter(id__in=removed), "followers_count", -1
+        )
+    return _statuses(author_ids, present, DELETED, MISSING)
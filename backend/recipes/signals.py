@@ -0,0 +1,69 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import (author_namespace, bump_version, recipe_namespace,
+                    table_namespace)
+from .models import Ingredient, Recipe, Tag
+from .services import change_counter
+
+User = get_user_model()
+
+AUTHOR_FIELDS = {"username", "first_name", "last_name", "email"}
+
+
+@receiver((post_save, post_delete))
+def invalidate_table(sender, **kwargs):
+    # Версия таблицы входит в ключ кешированного количества страниц.
+    bump_version(table_namespace(sender._meta.db_table))
+
+
+@receiver(m2m_changed)
+def invalidate_through_table(sender, action, **kwargs):
+    if action.startswith("post_"):
+        bump_version(table_namespace(sender._meta.db_table))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(**kwargs):
+    bump_version("tags")
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    bump_version("ingredients")
+
+
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_search(**kwargs):
+    bump_version("recipe_search")
+    bump_version("recipe_ingredients")
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def invalidate_recipe(instance, **kwargs):
+    bump_version(recipe_namespace(instance.id))
+
+
+@receiver(post_save, sender=Recipe)
+def count_created_recipe(instance, created, **kwargs):
+    # Счетчик ведется сигналами: рецепты создаются и удаляются и через API,
+    # и через админку, в том числе массовым действием.
+    if created:
+        change_counter(
+            User.objects.filter(id=instance.author_id), "recipes_count", 1
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted_recipe(instance, **kwargs):
+    change_counter(
+        User.objects.filter(id=instance.author_id), "recipes_count", -1
+    )
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(instance, update_fields=None, **kwargs):
+    # Вход в систему сохраняет только last_login.
+    if update_fields is None or AUTHOR_FIELDS & set(update_fields):
+        bump_version(author_namespace(instance.id))
@@ -4,9 +4,18 @@ from .models import User
 
 
 class UserAdmin(admin.ModelAdmin):
-    list_display = ("email", "username", "first_name", "last_name")
+    list_display = (
+        "email", "username", "first_name", "last_name",
+        "recipes_count", "followers_count",
+    )
     list_filter = ("email", "username")
     search_fields = ("email", "username")
+    actions = ("deactivate",)
+
+    @admin.action(description="Деактивировать выбранных пользователей")
+    def deactivate(self, request, queryset):
+        # Токены сбрасывает UserQuerySet.update.
+        queryset.update(is_active=False)
 
 
 admin.site.register(User, UserAdmin)
@@ -1,5 +1,28 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
+from django.dispatch import Signal
+
+# Поля, от которых зависит, пускать ли пользователя по токену.
+AUTH_FIELDS = {"is_active", "is_staff", "is_superuser", "password"}
+
+# Массовое обновление не вызывает post_save: закешированные по токену
+# снимки пользователей сбрасываются по этому сигналу.
+auth_fields_updated = Signal()
+
+
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        if AUTH_FIELDS.isdisjoint(kwargs):
+            return super().update(**kwargs)
+        user_ids = list(self.values_list("id", flat=True))
+        updated = super().update(**kwargs)
+        auth_fields_updated.send(sender=self.model, user_ids=user_ids)
+        return updated
+
+
+class CustomUserManager(UserManager):
+    def get_queryset(self):
+        return UserQuerySet(self.model, using=self._db)
 
 
 class User(AbstractUser):
@@ -13,6 +36,14 @@ class User(AbstractUser):
     last_name = models.CharField(
         max_length=150
     )
+    recipes_count = models.PositiveIntegerField(
+        "Рецептов", default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        "Подписчиков", default=0, editable=False
+    )
+
+    objects = CustomUserManager()
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username", "first_name", "last_name", "password"]
@@ -41,6 +72,7 @@ class Follow(models.Model):
     )
 
     class Meta:
+        ordering = ("-id",)
         verbose_name = "Подписка"
         verbose_name_plural = "Подписки"
         constraints = (